@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from posts import search
 from posts.models import Comment, Group, Post
 
 
@@ -9,6 +10,12 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ("pub_date",)
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        """ Поиск по полнотекстовому индексу вместо LIKE по тексту """
+        if not search.match_expression(search_term):
+            return queryset, False
+        return queryset.filter(pk__in=search.matching_ids(search_term)), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ("title", "slug", "description")
@@ -0,0 +1,154 @@
+""" JSON API лент только для чтения.
+
+Ленты строятся теми же запросами, что и HTML-страницы (posts/queries.py),
+и делятся на страницы тем же `CursorPaginator`. Ответ сериализуется
+по одному объекту и отдаётся `StreamingHttpResponse`, поэтому весь
+JSON не собирается в памяти. Параметры:
+
+* `cursor` — курсор страницы из полей `next` и `previous` ответа;
+* `limit` — размер страницы, не больше API_MAX_PAGE_SIZE;
+* `fields` — поля постов через запятую; загружаются только их колонки.
+"""
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+
+from posts import queries, timeline
+from posts.models import Group, User
+from posts.paginator import CursorPaginator
+
+ENCODER = DjangoJSONEncoder(ensure_ascii=False)
+
+# Поле API: (колонки модели, получение значения из поста)
+POST_FIELDS = {
+    'id': (('id',), lambda post: post.pk),
+    'text': (('text',), lambda post: post.text),
+    'pub_date': (('pub_date',), lambda post: post.pub_date),
+    'author': (('author__username',), lambda post: post.author.username),
+    'group': (('group__slug',),
+              lambda post: post.group.slug if post.group_id else None),
+    'image': (('image',),
+              lambda post: post.image.url if post.image else None),
+    'comments_count': (('comments_count',),
+                       lambda post: post.comments_count),
+}
+COMMENT_FIELDS = {
+    'id': lambda comment: comment.pk,
+    'author': lambda comment: comment.author.username,
+    'text': lambda comment: comment.text,
+    'created': lambda comment: comment.created,
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def requested_fields(request):
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(POST_FIELDS)
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = set(fields) - set(POST_FIELDS)
+    if unknown:
+        raise BadRequest(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+    return fields
+
+
+def page_size(request):
+    try:
+        limit = int(request.GET.get('limit', settings.API_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest('limit должен быть числом')
+    return max(1, min(limit, settings.API_MAX_PAGE_SIZE))
+
+
+def only_fields(queryset, fields, ordering):
+    """ Загружать только колонки запрошенных полей и ключа страницы """
+    columns = {name.lstrip('-') for name in ordering}
+    columns -= set(queryset.query.annotations)
+    columns.add('author_id')
+    columns.add('group_id')
+    for name in fields:
+        columns.update(POST_FIELDS[name][0])
+    return queryset.only(*columns)
+
+
+def serialize_post(post, fields):
+    return {name: POST_FIELDS[name][1](post) for name in fields}
+
+
+def stream_feed(request, queryset, ordering=('-pub_date', '-id')):
+    """ Потоковый ответ со страницей ленты """
+    try:
+        fields = requested_fields(request)
+        per_page = page_size(request)
+    except BadRequest as error:
+        return JsonResponse({'detail': str(error)}, status=400)
+
+    paginator = CursorPaginator(only_fields(queryset, fields, ordering),
+                                per_page, ordering)
+    page = paginator.get_page(request.GET.get('cursor'))
+
+    def chunks():
+        yield '{"results": ['
+        for number, post in enumerate(page):
+            yield (', ' if number else '') + ENCODER.encode(
+                serialize_post(post, fields)
+            )
+        yield '], "next": %s, "previous": %s}' % (
+            ENCODER.encode(page.next_cursor),
+            ENCODER.encode(page.previous_cursor),
+        )
+
+    return StreamingHttpResponse(chunks(), content_type='application/json')
+
+
+def index(request):
+    return stream_feed(request, queries.index_feed(excerpt=False))
+
+
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return stream_feed(request, queries.group_feed(group, excerpt=False))
+
+
+def profile(request, username):
+    author = get_object_or_404(User, username=username)
+    return stream_feed(request, queries.author_feed(author, excerpt=False))
+
+
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Требуется авторизация'}, status=403)
+    return stream_feed(request,
+                       queries.follow_feed(request.user, excerpt=False),
+                       timeline.FEED_ORDERING)
+
+
+def post_view(request, post_id):
+    """ Пост со всеми комментариями; комментарии читаются порциями """
+    try:
+        fields = requested_fields(request)
+    except BadRequest as error:
+        return JsonResponse({'detail': str(error)}, status=400)
+    post = queries.post_detail().filter(pk=post_id).first()
+    if post is None:
+        raise Http404
+    comments = post.comments.select_related('author').only(
+        'id', 'text', 'created', 'post', 'author', 'author__username'
+    ).order_by('-created')
+
+    def chunks():
+        yield '{"post": %s, "comments": [' % ENCODER.encode(
+            serialize_post(post, fields)
+        )
+        for number, comment in enumerate(comments.iterator()):
+            yield (', ' if number else '') + ENCODER.encode(
+                {name: value(comment)
+                 for name, value in COMMENT_FIELDS.items()}
+            )
+        yield ']}'
+
+    return StreamingHttpResponse(chunks(), content_type='application/json')
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        # Регистрация обработчиков сигналов (счётчики)
+        import posts.signals  # noqa
+        # Проверка общего кеша для `manage.py check --deploy`
+        import posts.checks  # noqa
@@ -0,0 +1,152 @@
+""" Версии лент для кеширования фрагментов шаблонов.
+
+Каждая лента (главная, группа, автор, отдельный пост) имеет версию —
+момент последнего изменения в миллисекундах. Версия входит в ключ
+кеша фрагмента, поэтому при изменении данных старые фрагменты просто
+перестают читаться и вытесняются сами, а TTL может быть большим.
+
+Версии хранятся в отдельном кеше FEED_VERSIONS_CACHE, чтобы их
+не вытесняли сами фрагменты. Если версия всё же потерялась, она
+создаётся заново по текущему времени и не совпадёт ни с одной старой.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db import transaction
+from django.views.decorators.http import condition
+
+INDEX = 'index'
+# Изменения, которые видны во всех лентах (например, название группы)
+GLOBAL = 'global'
+
+
+def group_scope(group_id):
+    return f'group-{group_id}'
+
+
+def author_scope(author_id):
+    return f'author-{author_id}'
+
+
+def post_scope(post_id):
+    return f'post-{post_id}'
+
+
+def post_scopes(post):
+    """ Ленты, в которых виден пост """
+    scopes = [INDEX, author_scope(post.author_id), post_scope(post.pk)]
+    if post.group_id is not None:
+        scopes.append(group_scope(post.group_id))
+    return scopes
+
+
+def _versions_cache():
+    # Без отдельного кеша версии хранятся в основном
+    alias = settings.FEED_VERSIONS_CACHE
+    return caches[alias if alias in settings.CACHES else DEFAULT_CACHE_ALIAS]
+
+
+def _key(scope):
+    return f'feed-version:{scope}'
+
+
+def _now():
+    return int(time.time() * 1000)
+
+
+def get_versions(*scopes):
+    """ Версии лент; отсутствующие версии создаются """
+    cache = _versions_cache()
+    keys = {_key(scope): scope for scope in scopes}
+    found = cache.get_many(keys)
+    missing = {key: _now() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def feed_version(*scopes):
+    """ Общая версия набора лент для ключа кеша """
+    versions = get_versions(GLOBAL, *scopes)
+    return '.'.join(str(versions[scope]) for scope in (GLOBAL,) + scopes)
+
+
+def bump(*scopes):
+    """ Отметить изменение лент после фиксации текущей транзакции.
+
+    Если поднять версию до фиксации, читатель, пришедший между ними,
+    закеширует старые строки уже под новой версией.
+    """
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def _bump(scopes):
+    # Новая версия строго больше старой
+    cache = _versions_cache()
+    keys = [_key(scope) for scope in set(scopes)]
+    old = cache.get_many(keys)
+    now = _now()
+    cache.set_many({key: max(now, old.get(key, 0) + 1) for key in keys},
+                   timeout=None)
+
+
+def fragment_context(request, *scopes, viewer=None):
+    """ Переменные шаблона для `{% cache %}` ленты.
+
+    `viewer` отделяет фрагменты, которые выглядят по-разному для разных
+    пользователей (ссылки «Редактировать» у своих постов). По умолчанию
+    анонимные посетители делят один фрагмент, а авторизованные получают свой.
+    """
+    if viewer is None:
+        viewer = request.user.pk or ''
+    return {
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+        'feed_version': feed_version(*scopes),
+        'feed_cursor': request.GET.get('cursor', ''),
+        'feed_viewer': viewer,
+    }
+
+
+def conditional(get_scopes, per_user=True):
+    """ Декоратор представления: условный GET по версиям лент.
+
+    `get_scopes(*args, **kwargs)` получает аргументы представления
+    и возвращает ленты, из которых собрана страница, или None, если
+    страницы нет. Пока версии не изменились, клиент с совпадающим
+    ETag получает 304 Not Modified без запросов лент и рендеринга.
+
+    Страница авторизованного пользователя отличается от анонимной
+    (меню, ссылки «Редактировать»), поэтому пользователь входит в ETag,
+    а Last-Modified, который его не учитывает, отдаётся только анонимам.
+    Для ответов, одинаковых для всех (RSS), передаётся `per_user=False`.
+    """
+    def versions(request, *args, **kwargs):
+        if not hasattr(request, 'feed_versions'):
+            scopes = get_scopes(*args, **kwargs)
+            request.feed_versions = (
+                None if scopes is None else get_versions(GLOBAL, *scopes)
+            )
+        return request.feed_versions
+
+    def etag(request, *args, **kwargs):
+        found = versions(request, *args, **kwargs)
+        if found is None:
+            return None
+        viewer = request.user.pk if per_user else None
+        key = ':'.join([str(viewer or '')]
+                       + [f'{scope}={found[scope]}'
+                          for scope in sorted(found)])
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        found = versions(request, *args, **kwargs)
+        if found is None or per_user and request.user.is_authenticated:
+            return None
+        return datetime.fromtimestamp(max(found.values()) // 1000,
+                                      tz=timezone.utc)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    """ Версии лент, фрагменты и страницы не в памяти процесса:
+    иначе воркеры не видят изменений, сделанных в других воркерах """
+    # Вместо отсутствующего кеша используется основной
+    aliases = {alias if alias in settings.CACHES else DEFAULT_CACHE_ALIAS
+               for alias in (settings.FEED_VERSIONS_CACHE,
+                             settings.PAGE_CACHE, 'template_fragments')}
+    return [
+        Warning(f'Кеш {alias!r} хранится в памяти процесса',
+                hint=('Версии лент и страницы не будут общими для '
+                      'нескольких процессов: задайте CACHE_DIR или '
+                      'другой общий бэкенд кеша'),
+                id='posts.W001')
+        for alias in sorted(aliases)
+        if isinstance(caches[alias], LocMemCache)
+    ]
@@ -0,0 +1,118 @@
+""" Ленты RSS и Atom групп и авторов.
+
+Лента собирается один раз на версию своей ленты постов (см. posts/cache.py)
+и хранится в кеше, пока пост группы или автора не изменится. Клиенты,
+которые опрашивают ленту, получают 304 Not Modified по ETag
+и Last-Modified, не дожидаясь даже чтения из кеша.
+"""
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.core.cache import caches
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.text import Truncator
+
+from posts import cache, queries
+from posts.models import Group, User
+from posts.views import group_scopes, profile_scopes
+
+
+class PostFeed(Feed):
+    """ Общая часть лент: последние SYNDICATION_ITEMS постов """
+    def items(self, obj):
+        return self.posts(obj).order_by('-pub_date', '-id')[
+            :settings.SYNDICATION_ITEMS
+        ]
+
+    def item_title(self, item):
+        return Truncator(item.preview).words(10)
+
+    def item_description(self, item):
+        return item.text
+
+    def item_link(self, item):
+        return reverse('post', kwargs={'username': item.author.username,
+                                       'post_id': item.pk})
+
+    def item_pubdate(self, item):
+        return item.pub_date
+
+    def item_author_name(self, item):
+        return item.author.get_full_name() or item.author.username
+
+
+class GroupFeed(PostFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Group, slug=slug)
+
+    def posts(self, group):
+        return queries.group_feed(group, excerpt=False)
+
+    def title(self, group):
+        return f'Yatube: {group.title}'
+
+    def link(self, group):
+        return reverse('group_posts', kwargs={'slug': group.slug})
+
+    def description(self, group):
+        return group.description
+
+
+class GroupAtomFeed(GroupFeed):
+    feed_type = Atom1Feed
+    subtitle = GroupFeed.description
+
+
+class AuthorFeed(PostFeed):
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def posts(self, author):
+        return queries.author_feed(author, excerpt=False)
+
+    def title(self, author):
+        return f'Yatube: {author.get_full_name() or author.username}'
+
+    def link(self, author):
+        return reverse('profile', kwargs={'username': author.username})
+
+    def description(self, author):
+        return f'Записи пользователя {author.username}'
+
+
+class AuthorAtomFeed(AuthorFeed):
+    feed_type = Atom1Feed
+    subtitle = AuthorFeed.description
+
+
+def cached(feed, get_scopes):
+    """ Представление ленты с кешем по версиям и условным GET """
+    @cache.conditional(get_scopes, per_user=False)
+    def view(request, *args, **kwargs):
+        versions = request.feed_versions
+        if versions is None:
+            return feed(request, *args, **kwargs)
+
+        key = 'syndication:{}:{}'.format(
+            request.build_absolute_uri(request.path),
+            '.'.join(f'{scope}={versions[scope]}'
+                     for scope in sorted(versions)),
+        )
+        pages = caches[settings.PAGE_CACHE]
+        response = pages.get(key)
+        if response is None:
+            response = feed(request, *args, **kwargs)
+            # Дата последнего поста не учитывает правки; Last-Modified
+            # выставит conditional по версии ленты
+            del response['Last-Modified']
+            pages.set(key, response, settings.FEED_CACHE_TIMEOUT)
+        return response
+
+    return view
+
+
+group_rss = cached(GroupFeed(), group_scopes)
+group_atom = cached(GroupAtomFeed(), group_scopes)
+author_rss = cached(AuthorFeed(), profile_scopes)
+author_atom = cached(AuthorAtomFeed(), profile_scopes)
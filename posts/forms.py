@@ -1,5 +1,9 @@
 from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.template.defaultfilters import filesizeformat
 
+from posts import images
 from posts.models import Comment, Post
 
 
@@ -14,6 +18,30 @@ class PostForm(forms.ModelForm):
             'image': 'Изображение для вашего поста',
         }
 
+    def __init__(self, *args, rejected_files=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        # Поля, файлы которых отклонил UploadSizeLimitHandler
+        self.rejected_files = rejected_files
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for field in self.rejected_files:
+            if field in self.fields:
+                self.add_error(field, forms.ValidationError(
+                    'Файл больше %(limit)s.', code='file_too_large',
+                    params={'limit': filesizeformat(
+                        settings.UPLOAD_MAX_FILE_SIZE
+                    )},
+                ))
+        return cleaned_data
+
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # Перекодируются только новые загрузки, а не уже сохранённый файл
+        if isinstance(image, UploadedFile):
+            return images.process_upload(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     """ Форма для создания комментария """
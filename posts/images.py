@@ -0,0 +1,68 @@
+""" Обработка загруженных изображений постов.
+
+Изображение декодируется один раз: проверяется размер в пикселях,
+снимок поворачивается по EXIF, уменьшается до POST_IMAGE_MAX_SIDE
+и перекодируется без метаданных в прогрессивный JPEG
+(или в WebP, если у изображения есть прозрачность).
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+
+def _has_alpha(image):
+    return (image.mode in ('RGBA', 'LA')
+            or (image.mode == 'P' and 'transparency' in image.info))
+
+
+def process_upload(uploaded):
+    """ Вернуть перекодированное изображение как ContentFile """
+    uploaded.seek(0)
+    try:
+        image = Image.open(uploaded)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError('Загрузите правильное изображение.',
+                              code='invalid_image')
+
+    width, height = image.size
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Изображение слишком большое: %(width)s×%(height)s пикселей.',
+            code='too_many_pixels',
+            params={'width': width, 'height': height},
+        )
+
+    max_side = settings.POST_IMAGE_MAX_SIDE
+    try:
+        # Для JPEG декодер сразу уменьшает снимок в 2-8 раз
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    except OSError:
+        raise ValidationError('Изображение повреждено.',
+                              code='invalid_image')
+
+    output = BytesIO()
+    if _has_alpha(image):
+        image.convert('RGBA').save(output, 'WEBP',
+                                   quality=settings.POST_IMAGE_QUALITY)
+        extension = 'webp'
+    else:
+        image.convert('RGB').save(output, 'JPEG',
+                                  quality=settings.POST_IMAGE_QUALITY,
+                                  optimize=True, progressive=True)
+        extension = 'jpg'
+
+    stem = os.path.splitext(os.path.basename(uploaded.name))[0]
+    processed = ContentFile(output.getvalue(), name=f'{stem}.{extension}')
+    logger.info('Изображение %s: %s -> %s байт, сэкономлено %s байт',
+                uploaded.name, uploaded.size, processed.size,
+                uploaded.size - processed.size)
+    return processed
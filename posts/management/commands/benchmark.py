@@ -0,0 +1,171 @@
+import json
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import urls
+from posts.models import AuthorStats, Group, Post, User
+
+# Параметры строки запроса для страниц, которым они нужны
+QUERY_STRINGS = {'search': {'q': 'привет'}}
+# Страницы, которые меняют базу GET-запросом: их запросы откатываются
+CHANGES_DATA = {'profile_follow', 'profile_unfollow'}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Измеряет каждую страницу из posts/urls.py на текущей базе: "
+            "задержку p50/p95/p99, число запросов к базе и размер ответа. "
+            "Запросы страниц подписки и отписки выполняются "
+            "в откатываемой транзакции и базу не меняют; остальные "
+            "страницы запрашиваются как на сайте, без транзакции. "
+            "Результаты можно сохранить и сравнить с другим прогоном.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Сколько раз запросить каждую страницу')
+        parser.add_argument('--anonymous', action='store_true',
+                            help='Запрашивать страницы без входа на сайт')
+        parser.add_argument('--cold', action='store_true',
+                            help='Очищать кеши перед каждым запросом')
+        parser.add_argument('--only', nargs='*', metavar='NAME',
+                            help='Имена страниц из posts/urls.py')
+        parser.add_argument('--output', metavar='FILE.json',
+                            help='Сохранить результаты в файл')
+        parser.add_argument('--compare', metavar='FILE.json',
+                            help='Сравнить с сохранёнными результатами')
+
+    def handle(self, *args, **options):
+        kwargs = self.sample_kwargs()
+        client = Client()
+        if not options['anonymous']:
+            client.force_login(User.objects.get(pk=kwargs['user_id']))
+
+        results = {}
+        for pattern in urls.urlpatterns:
+            if options['only'] and pattern.name not in options['only']:
+                continue
+            url = reverse(pattern.name, kwargs={
+                name: kwargs[name] for name in pattern.pattern.converters
+            })
+            results[pattern.name] = self.measure(
+                client, url, QUERY_STRINGS.get(pattern.name, {}),
+                pattern.name in CHANGES_DATA, options
+            )
+
+        baseline = self.load(options['compare']) if options['compare'] else {}
+        self.print_table(results, baseline.get('results', {}))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump({'revision': self.revision(), 'options': {
+                    key: options[key]
+                    for key in ('repeat', 'anonymous', 'cold')
+                }, 'results': results}, output, indent=2, ensure_ascii=False)
+
+    def sample_kwargs(self):
+        """ Самые «тяжёлые» объекты базы: их страницы медленнее прочих """
+        stats = AuthorStats.objects.order_by('-posts_count').first()
+        group = Group.objects.annotate(
+            total=Count('posts')
+        ).order_by('-total').first()
+        if stats is None or group is None:
+            raise CommandError('База пуста: заполните её командой seed')
+        post = Post.objects.filter(author_id=stats.user_id).order_by(
+            '-comments_count'
+        ).first()
+        if post is None:
+            raise CommandError(
+                f'У автора {stats.user.username} нет постов: '
+                f'пересчитайте счётчики командой recount'
+            )
+        reader = AuthorStats.objects.order_by('-following_count').first()
+        return {'slug': group.slug,
+                'username': stats.user.username,
+                'post_id': post.pk,
+                'user_id': reader.user_id}
+
+    def measure(self, client, url, params, rollback, options):
+        timings, queries, sizes, statuses = [], [], [], set()
+        for _ in range(options['repeat']):
+            if options['cold']:
+                for cache in caches.all():
+                    cache.clear()
+            if rollback:
+                try:
+                    with transaction.atomic():
+                        result = self.get(client, url, params)
+                        raise Rollback
+                except Rollback:
+                    pass
+            else:
+                result = self.get(client, url, params)
+            elapsed, count, response, content = result
+            timings.append(elapsed)
+            queries.append(count)
+            sizes.append(len(content))
+            statuses.add(response.status_code)
+
+        percentiles = statistics.quantiles(timings, n=100) if len(
+            timings) > 1 else timings * 99
+        return {'url': url,
+                'status': sorted(statuses),
+                'p50_ms': round(percentiles[49] * 1000, 2),
+                'p95_ms': round(percentiles[94] * 1000, 2),
+                'p99_ms': round(percentiles[98] * 1000, 2),
+                'queries': max(queries),
+                'bytes': max(sizes)}
+
+    def get(self, client, url, params):
+        """ Время ответа, число запросов ко всем базам (в том числе
+        репликам), ответ и его содержимое """
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(database))
+                        for database in connections.all()]
+            started = time.perf_counter()
+            response = client.get(url, params)
+            content = (b''.join(response.streaming_content)
+                       if response.streaming else response.content)
+            elapsed = time.perf_counter() - started
+        return (elapsed, sum(len(queries) for queries in captured),
+                response, content)
+
+    def load(self, path):
+        try:
+            with open(path, encoding='utf-8') as source:
+                return json.load(source)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+
+    def revision(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def print_table(self, results, baseline):
+        self.stdout.write(f'{"страница":<20} {"p50":>9} {"p95":>9} '
+                          f'{"p99":>9} {"запросы":>8} {"байты":>9}')
+        for name, result in results.items():
+            line = (f'{name:<20} {result["p50_ms"]:>7.2f}мс '
+                    f'{result["p95_ms"]:>7.2f}мс {result["p99_ms"]:>7.2f}мс '
+                    f'{result["queries"]:>8} {result["bytes"]:>9}')
+            old = baseline.get(name)
+            if old:
+                line += (f'  (p50 {result["p50_ms"] - old["p50_ms"]:+.2f}мс, '
+                         f'запросы {result["queries"] - old["queries"]:+d})')
+            self.stdout.write(line)
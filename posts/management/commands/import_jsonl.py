@@ -0,0 +1,310 @@
+import contextlib
+import json
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+
+from posts import cache, search, storage, timeline
+from posts.models import AuthorStats, Comment, Follow, Group, Post, User
+
+# Порядок сохранения пачек: записи ссылаются на сохранённые раньше
+TYPES = ('user', 'group', 'post', 'comment', 'follow')
+# Сколько id передаётся в одном UPDATE ... WHERE id IN (...)
+UPDATE_CHUNK = 500
+
+# Обязательные поля и поля с датами записей каждого типа
+REQUIRED = {
+    'user': ('username',),
+    'group': ('slug', 'title'),
+    'post': ('id', 'author', 'text', 'pub_date'),
+    'comment': ('post', 'author', 'text', 'created'),
+    'follow': ('user', 'author'),
+}
+DATES = {
+    'user': 'date_joined',
+    'post': 'pub_date',
+    'comment': 'created',
+}
+
+
+@contextlib.contextmanager
+def explicit_dates(model, name):
+    """ Дата поля `name` берётся из объекта, а не из текущего времени.
+
+    auto_now_add меняется у поля модели, то есть для всего процесса,
+    поэтому оборачивает только bulk_create.
+    """
+    field = model._meta.get_field(name)
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def parse_date(value):
+    """ datetime из строки ISO 8601 или None, если её не разобрать """
+    try:
+        return parse_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Загружает пользователей, группы, посты, комментарии и подписки "
+            "из файлов JSON Lines пачками bulk_create, в обход сигналов. "
+            "Каждая строка — объект с полем type: user, group, post, comment "
+            "или follow. Пользователи и группы указываются по username "
+            "и slug, посты — по id, который сохраняется. Запись должна идти "
+            "после тех, на кого ссылается. В памяти держатся только "
+            "соответствия username и slug их id. Счётчики обновляются "
+            "вместе с каждой пачкой, после загрузки заполняются ленты "
+            "подписок и сбрасываются кеши лент.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='file.jsonl')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Размер пачки одного типа (по умолчанию 5000)',
+        )
+
+    def handle(self, *args, paths, batch_size, **options):
+        self.load(self.read(paths), batch_size)
+
+    def read(self, paths):
+        for path in paths:
+            with open(path, encoding='utf-8') as source:
+                for number, line in enumerate(source, 1):
+                    if line.strip():
+                        yield self.parse(line, path, number)
+
+    def load(self, records, batch_size):
+        """ Загрузить записи из итератора (используется и командой seed) """
+        self.batch_size = batch_size
+        self.users = {}
+        self.groups = {}
+        self.pending = {kind: [] for kind in TYPES}
+        self.saved = dict.fromkeys(TYPES, 0)
+        self.skipped = 0
+        self.started = time.monotonic()
+
+        for record in records:
+            self.add(record)
+        self.flush()
+
+        self.report()
+        self.finish()
+
+    def parse(self, line, path, number):
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise CommandError(f'{path}:{number}: {error}')
+        if not isinstance(record, dict) or record.get('type') not in TYPES:
+            raise CommandError(f'{path}:{number}: неизвестный type')
+        kind = record['type']
+        for key in REQUIRED[kind]:
+            if record.get(key) in (None, ''):
+                raise CommandError(f'{path}:{number}: нет поля {key}')
+        date = DATES.get(kind)
+        if record.get(date) and parse_date(record[date]) is None:
+            raise CommandError(
+                f'{path}:{number}: не удалось разобрать дату {date}'
+            )
+        return record
+
+    def add(self, record):
+        batch = self.pending[record['type']]
+        batch.append(record)
+        if len(batch) >= self.batch_size:
+            self.flush()
+            self.report()
+
+    def flush(self):
+        """ Сохранить накопленные пачки в одной транзакции """
+        with transaction.atomic():
+            for kind in TYPES:
+                batch = self.pending[kind]
+                if batch:
+                    saved = getattr(self, f'save_{kind}s')(batch)
+                    self.saved[kind] += saved
+                    self.skipped += len(batch) - saved
+                    self.pending[kind] = []
+
+    def resolve(self, mapping, model, field, keys):
+        """ id объектов по естественным ключам; неизвестные ищутся в базе """
+        missing = {key for key in keys if key and key not in mapping}
+        if missing:
+            mapping.update(model.objects.filter(
+                **{f'{field}__in': missing}
+            ).values_list(field, 'pk'))
+        return mapping
+
+    def increment(self, model, field, deltas):
+        """ Увеличить `field` строк `model` на приросты из `deltas`
+        (pk → прирост): строки с одинаковым приростом — одним UPDATE """
+        by_delta = defaultdict(list)
+        for pk, delta in deltas.items():
+            by_delta[delta].append(pk)
+        for delta, pks in by_delta.items():
+            for start in range(0, len(pks), UPDATE_CHUNK):
+                model.objects.filter(
+                    pk__in=pks[start:start + UPDATE_CHUNK]
+                ).update(**{field: F(field) + delta})
+
+    def existing(self, model, field, values):
+        """ Значения `field`, уже сохранённые в базе: такие строки
+        bulk_create(ignore_conflicts=True) пропустит """
+        return set(model.objects.filter(
+            **{f'{field}__in': values}
+        ).values_list(field, flat=True))
+
+    def save_users(self, batch):
+        usernames = {record['username'] for record in batch}
+        new = usernames - self.existing(User, 'username', usernames)
+        users = []
+        for record in batch:
+            user = User(username=record['username'],
+                        email=record.get('email', ''),
+                        first_name=record.get('first_name', ''),
+                        last_name=record.get('last_name', ''),
+                        password=record.get('password')
+                        or make_password(None))
+            if record.get('date_joined'):
+                user.date_joined = parse_datetime(record['date_joined'])
+            users.append(user)
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        # SQLite не возвращает id созданных строк
+        self.resolve(self.users, User, 'username', usernames)
+        AuthorStats.objects.bulk_create(
+            [AuthorStats(user_id=self.users[username]) for username in new],
+            ignore_conflicts=True,
+        )
+        return len(new)
+
+    def save_groups(self, batch):
+        slugs = {record['slug'] for record in batch}
+        new = slugs - self.existing(Group, 'slug', slugs)
+        Group.objects.bulk_create(
+            [Group(slug=record['slug'], title=record['title'],
+                   description=record.get('description', ''))
+             for record in batch],
+            ignore_conflicts=True,
+        )
+        self.resolve(self.groups, Group, 'slug', slugs)
+        return len(new)
+
+    def save_posts(self, batch):
+        users = self.resolve(self.users, User, 'username',
+                             [record['author'] for record in batch])
+        groups = self.resolve(self.groups, Group, 'slug',
+                              [record.get('group') for record in batch])
+        posts = [Post(pk=record['id'],
+                      text=record['text'],
+                      pub_date=parse_datetime(record['pub_date']),
+                      author_id=users[record['author']],
+                      group_id=groups.get(record.get('group')),
+                      image=record.get('image') or None)
+                 for record in batch if record['author'] in users]
+        # bulk_create не вызывает save(), где готовится текст
+        for post in posts:
+            post.render_text()
+        existing = self.existing(Post, 'pk', [post.pk for post in posts])
+        # Из повторов id в пачке вставится первый
+        new = {}
+        for post in posts:
+            if post.pk not in existing:
+                new.setdefault(post.pk, post)
+        with explicit_dates(Post, 'pub_date'):
+            Post.objects.bulk_create(posts, ignore_conflicts=True)
+        # bulk_create не вызывает и сигнал, считающий ссылки на файлы
+        images = Counter(post.image.name for post in new.values()
+                         if post.image)
+        for name, count in images.items():
+            storage.acquire(name, count)
+        self.increment(AuthorStats, 'posts_count',
+                       Counter(post.author_id for post in new.values()))
+        if posts:
+            search.index_posts([post.pk for post in posts])
+        return len(new)
+
+    def save_comments(self, batch):
+        users = self.resolve(self.users, User, 'username',
+                             [record['author'] for record in batch])
+        # Посты не держатся в памяти: их id проверяются по базе
+        posts = set(Post.objects.filter(
+            pk__in={record['post'] for record in batch}
+        ).values_list('pk', flat=True))
+        comments = [Comment(post_id=record['post'],
+                            author_id=users[record['author']],
+                            text=record['text'],
+                            created=parse_datetime(record['created']))
+                    for record in batch
+                    if record['author'] in users and record['post'] in posts]
+        with explicit_dates(Comment, 'created'):
+            Comment.objects.bulk_create(comments)
+        self.increment(Post, 'comments_count',
+                       Counter(comment.post_id for comment in comments))
+        return len(comments)
+
+    def save_follows(self, batch):
+        users = self.resolve(
+            self.users, User, 'username',
+            [record[key] for record in batch for key in ('user', 'author')]
+        )
+        follows = [Follow(user_id=users[record['user']],
+                          author_id=users[record['author']])
+                   for record in batch
+                   if record['user'] in users and record['author'] in users
+                   and record['user'] != record['author']]
+        pairs = {(follow.user_id, follow.author_id) for follow in follows}
+        existing = set(Follow.objects.filter(
+            user_id__in={user_id for user_id, _ in pairs},
+            author_id__in={author_id for _, author_id in pairs},
+        ).values_list('user_id', 'author_id'))
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        new = pairs - existing
+        self.increment(AuthorStats, 'followers_count',
+                       Counter(author_id for _, author_id in new))
+        self.increment(AuthorStats, 'following_count',
+                       Counter(user_id for user_id, _ in new))
+        return len(new)
+
+    def report(self):
+        total = sum(self.saved.values())
+        elapsed = time.monotonic() - self.started
+        counts = ', '.join(f'{kind}: {count}'
+                           for kind, count in self.saved.items())
+        self.stdout.write(
+            f'{total} строк за {elapsed:.1f} с '
+            f'({total / max(elapsed, 1e-9):.0f} строк/с); {counts}'
+        )
+
+    def finish(self):
+        """ Привести в порядок то, что обычно делают сигналы """
+        # Раскладка постов по числу подписчиков, без гистерезиса
+        stats = AuthorStats.objects.all()
+        limit = settings.FOLLOW_FANOUT_LIMIT
+        stats.filter(followers_count__gt=limit).update(fanout=False)
+        stats.filter(followers_count__lte=limit).update(fanout=True)
+
+        self.stdout.write('Заполнение лент подписок…')
+        users = Follow.objects.values_list('user_id', flat=True).distinct()
+        for user_id in users.iterator():
+            with transaction.atomic():
+                timeline.refill(user_id)
+
+        # Новые данные видны во всех лентах
+        cache.bump(cache.GLOBAL)
+        if self.skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Пропущено записей, уже загруженных или со ссылками '
+                f'на отсутствующие объекты: {self.skipped}'
+            ))
+        self.stdout.write(self.style.SUCCESS('Загрузка завершена'))
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from posts.models import AuthorStats, Comment, Post, count_subquery
+
+
+class Command(BaseCommand):
+    help = ("Пересчитывает денормализованные счётчики постов, комментариев "
+            "и подписок и исправляет расхождения")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не исправляя',
+        )
+
+    def handle(self, *args, dry_run=False, **options):
+        self.verbosity = options['verbosity']
+        with transaction.atomic():
+            posts_fixed = self.repair_comment_counts(dry_run)
+            authors_fixed = self.repair_author_stats(dry_run)
+            if dry_run:
+                transaction.set_rollback(True)
+
+        verb = 'Найдено расхождений' if dry_run else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb}: постов {posts_fixed}, авторов {authors_fixed}'
+        ))
+
+    def repair_comment_counts(self, dry_run):
+        drifted = Post.objects.annotate(
+            actual=count_subquery(Comment, 'post')
+        ).exclude(comments_count=F('actual'))
+
+        fixed = 0
+        for post_id, stored, actual in drifted.values_list(
+                'pk', 'comments_count', 'actual').iterator():
+            if self.verbosity:
+                self.stdout.write(
+                    f'Пост {post_id}: комментариев {stored} -> {actual}'
+                )
+            if not dry_run:
+                Post.objects.filter(pk=post_id).update(comments_count=actual)
+            fixed += 1
+        return fixed
+
+    def repair_author_stats(self, dry_run):
+        drifted = AuthorStats.objects.with_actual_counts().filter(
+            Q(stats__isnull=True)
+            | ~Q(stats__posts_count=F('actual_posts'))
+            | ~Q(stats__followers_count=F('actual_followers'))
+            | ~Q(stats__following_count=F('actual_following'))
+        )
+
+        fixed = 0
+        for user in drifted.iterator():
+            if self.verbosity:
+                self.stdout.write(
+                    f'Пользователь {user.username}: '
+                    f'записей {user.actual_posts}, '
+                    f'подписчиков {user.actual_followers}, '
+                    f'подписок {user.actual_following}'
+                )
+            if not dry_run:
+                AuthorStats.objects.update_or_create(
+                    user_id=user.pk,
+                    defaults={'posts_count': user.actual_posts,
+                              'followers_count': user.actual_followers,
+                              'following_count': user.actual_following}
+                )
+            fixed += 1
+        return fixed
@@ -0,0 +1,100 @@
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.template.utils import InvalidTemplateEngineError
+from django.test import RequestFactory
+
+from posts import queries
+from posts.models import AuthorStats, Group
+from posts.paginator import CursorPaginator
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает время рендеринга шаблонов ленты шаблонами Django "
+            "и их версиями на Jinja2 (templates/jinja2) для страниц "
+            "с заданным числом постов. Посты читаются из базы заранее, "
+            "кеш фрагментов не используется, поэтому замеряется только "
+            "рендеринг. Заодно проверяется, что вывод совпадает.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, nargs='+', default=[10, 100],
+                            metavar='N', help='Размеры страниц ленты')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Сколько раз рендерить каждую страницу')
+
+    def handle(self, *args, posts=(10, 100), repeat=20, **options):
+        try:
+            jinja2 = engines['jinja2']
+        except InvalidTemplateEngineError:
+            raise CommandError('Jinja2 не установлен')
+        django = next(engine for engine in engines.all()
+                      if isinstance(engine, DjangoTemplates))
+
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+
+        self.stdout.write(f'{"шаблон":<14} {"постов":>6} {"Django":>9} '
+                          f'{"Jinja2":>9} {"ускорение":>9}')
+        for size in posts:
+            for name, context in self.contexts(size):
+                django_ms, expected = self.measure(
+                    django.get_template(name), context, request, repeat
+                )
+                jinja2_ms, output = self.measure(
+                    jinja2.load(name), context, request, repeat
+                )
+                line = (f'{name:<14} {len(context["page"]):>6} '
+                        f'{django_ms:>7.2f}мс {jinja2_ms:>7.2f}мс '
+                        f'{django_ms / jinja2_ms:>8.1f}x')
+                if output != expected:
+                    line += self.style.ERROR('  вывод отличается')
+                self.stdout.write(line)
+
+    def contexts(self, size):
+        """ Контексты шаблонов ленты с самыми длинными лентами базы """
+        stats = AuthorStats.objects.order_by('-posts_count').first()
+        group = Group.objects.annotate(
+            total=Count('posts')
+        ).order_by('-total').first()
+        if stats is None or group is None:
+            raise CommandError('База пуста: заполните её командой seed')
+        author = stats.user
+
+        profile = {'author': author,
+                   'full_name': author.get_full_name,
+                   'count': stats.posts_count,
+                   'following': None,
+                   'followers': stats.followers_count,
+                   'following_authors': stats.following_count}
+        for name, feed, extra in (
+                ('index.html', queries.index_feed(), {}),
+                ('group.html', queries.group_feed(group), {'group': group}),
+                ('profile.html', queries.author_feed(author), profile)):
+            paginator = CursorPaginator(feed, size)
+            page = paginator.get_page(None)
+            # Запрос ленты выполняется до замера
+            page.has_other_pages()
+            yield name, {'page': page,
+                         'paginator': paginator,
+                         # Фрагмент истекает сразу и рендерится каждый раз
+                         'feed_cache_timeout': 0,
+                         'feed_version': '',
+                         'feed_cursor': '',
+                         'feed_viewer': '',
+                         **extra}
+
+    def measure(self, template, context, request, repeat):
+        """ Медиана времени рендеринга в миллисекундах и вывод шаблона """
+        # Первый рендеринг компилирует шаблон и заполняет кеши url
+        output = template.render(dict(context), request)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            template.render(dict(context), request)
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings) * 1000, output
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from posts.models import RENDERED_FIELDS, Post
+
+
+class Command(BaseCommand):
+    help = ("Заполняет подготовленный к выводу текст постов (text_html, "
+            "начало текста для лент) и превью у постов, сохранённых "
+            "без них: до миграции, через bulk_create или update(). "
+            "Посты обновляются пачками, каждая в своей транзакции.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Перестроить текст всех постов')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, all=False, batch_size=1000, **options):
+        posts = Post.objects.order_by('pk').only('pk', 'text')
+        if not all:
+            posts = posts.filter(Q(text_html='') | Q(excerpt_html=''))
+
+        total = 0
+        last_pk = 0
+        while True:
+            # Ключ вместо OFFSET: обновлённые посты выпадают из выборки
+            batch = list(posts.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            for post in batch:
+                post.render_text()
+            with transaction.atomic():
+                Post.objects.bulk_update(batch, RENDERED_FIELDS)
+            total += len(batch)
+            last_pk = batch[-1].pk
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Обработано постов: {total}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Текст подготовлен у постов: {total}'
+        ))
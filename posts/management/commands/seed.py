@@ -0,0 +1,136 @@
+import itertools
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from posts.management.commands.import_jsonl import Command as ImportCommand
+from posts.models import Post
+
+WORDS = ('привет мир сегодня вчера завтра кот собака город море лес '
+         'книга фильм музыка работа дом друг погода утро вечер ночь '
+         'новость проект идея вопрос ответ фото путешествие кофе чай '
+         'код python django запрос страница лента подписка').split()
+
+
+class Command(BaseCommand):
+    help = ("Заполняет базу синтетическими данными для нагрузочных "
+            "измерений: активность авторов, популярность групп и число "
+            "подписчиков распределены по закону Ципфа, комментарии чаще "
+            "достаются свежим постам. Данные загружаются так же, "
+            "как командой import_jsonl.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--follows', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней распределить посты')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Показатель закона Ципфа')
+        parser.add_argument('--prefix', default='seed',
+                            help='Префикс имён пользователей и групп')
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['random_seed'])
+        self.first_post_id = (
+            Post.objects.aggregate(last=Max('pk'))['last'] or 0
+        ) + 1
+        self.end = timezone.now()
+        self.start = self.end - timedelta(days=options['days'])
+
+        records = itertools.chain(self.users(), self.groups(), self.posts(),
+                                  self.comments(), self.follows())
+        loader = ImportCommand(stdout=self.stdout, stderr=self.stderr)
+        loader.load(records, options['batch_size'])
+
+    def zipf(self, count):
+        """ Накопленные веса закона Ципфа для rng.choices """
+        weights = (1 / (rank + 1) ** self.options['skew']
+                   for rank in range(count))
+        return list(itertools.accumulate(weights))
+
+    def pick(self, population, cum_weights, k):
+        return self.rng.choices(population, cum_weights=cum_weights, k=k)
+
+    def username(self, number):
+        return f'{self.options["prefix"]}_user_{number}'
+
+    def slug(self, number):
+        return f'{self.options["prefix"]}-group-{number}'
+
+    def text(self):
+        length = max(1, int(self.rng.lognormvariate(3, 0.8)))
+        return ' '.join(self.rng.choices(WORDS, k=length)).capitalize()
+
+    def post_date(self, post_id):
+        """ Дата поста растёт вместе с id, как у настоящих публикаций """
+        share = (post_id - self.first_post_id) / max(self.options['posts'], 1)
+        return self.start + (self.end - self.start) * share
+
+    def users(self):
+        for number in range(self.options['users']):
+            yield {'type': 'user', 'username': self.username(number),
+                   'first_name': f'Пользователь {number}'}
+
+    def groups(self):
+        for number in range(self.options['groups']):
+            yield {'type': 'group', 'slug': self.slug(number),
+                   'title': f'Группа {number}', 'description': self.text()}
+
+    def chunks(self, total):
+        size = self.options['batch_size']
+        for offset in range(0, total, size):
+            yield min(size, total - offset)
+
+    def posts(self):
+        users = range(self.options['users'])
+        authors = self.zipf(len(users))
+        groups = range(self.options['groups'])
+        group_weights = self.zipf(len(groups))
+        post_id = self.first_post_id
+        for size in self.chunks(self.options['posts']):
+            for author in self.pick(users, authors, size):
+                group = None
+                if groups and self.rng.random() < 0.7:
+                    group = self.slug(
+                        self.pick(groups, group_weights, 1)[0]
+                    )
+                yield {'type': 'post', 'id': post_id,
+                       'author': self.username(author), 'group': group,
+                       'text': self.text(),
+                       'pub_date': self.post_date(post_id).isoformat()}
+                post_id += 1
+
+    def comments(self):
+        total = self.options['posts']
+        if not total:
+            return
+        for _ in range(self.options['comments']):
+            # Максимум из двух случайных номеров смещён к свежим постам
+            offset = max(self.rng.randrange(total), self.rng.randrange(total))
+            post_id = self.first_post_id + offset
+            created = self.post_date(post_id) + timedelta(
+                minutes=self.rng.expovariate(1 / 120)
+            )
+            yield {'type': 'comment', 'post': post_id,
+                   'author': self.username(
+                       self.rng.randrange(self.options['users'])),
+                   'text': self.text(),
+                   'created': min(created, self.end).isoformat()}
+
+    def follows(self):
+        users = range(self.options['users'])
+        authors = self.zipf(len(users))
+        for size in self.chunks(self.options['follows']):
+            for author in self.pick(users, authors, size):
+                yield {'type': 'follow',
+                       'user': self.username(self.rng.choice(users)),
+                       'author': self.username(author)}
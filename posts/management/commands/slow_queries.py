@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from yatube import slow_queries
+
+
+class Command(BaseCommand):
+    help = ("Сводка журнала медленных запросов: формы запросов, "
+            "упорядоченные по суммарному времени, с представлениями, "
+            "строками кода, откуда они пришли, и планами выполнения")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=None, metavar='FILE',
+                            help='Журнал (по умолчанию SLOW_QUERY_LOG)')
+        parser.add_argument('--top', type=int, default=10,
+                            help='Сколько форм показать')
+
+    def handle(self, *args, log=None, top=10, **options):
+        path = log or settings.SLOW_QUERY_LOG
+        try:
+            shapes = slow_queries.aggregate(slow_queries.read(path))
+        except OSError as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+
+        if not shapes:
+            self.stdout.write('Медленных запросов нет')
+            return
+        for entry in shapes[:top]:
+            self.stdout.write(self.style.WARNING(
+                f'[{entry["fingerprint"]}] {entry["count"]} раз, '
+                f'всего {entry["total_ms"]:.1f} мс, '
+                f'среднее {entry["total_ms"] / entry["count"]:.1f} мс, '
+                f'наибольшее {entry["max_ms"]:.1f} мс'
+            ))
+            self.stdout.write(f'  {entry["shape"]}')
+            for title, counts in (('Представления', entry['views']),
+                                  ('Код', entry['origins'])):
+                if counts:
+                    self.stdout.write(f'  {title}: ' + ', '.join(
+                        f'{name} ({count})' for name, count in
+                        sorted(counts.items(), key=lambda item: -item[1])
+                    ))
+            for line in entry['plan'] or ():
+                self.stdout.write(f'    {line}')
+            self.stdout.write('')
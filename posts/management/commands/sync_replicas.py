@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from posts import cache
+
+
+class Command(BaseCommand):
+    help = ("Копирует основную базу SQLite в реплики из DATABASE_REPLICAS "
+            "через backup API: копия согласована, читатели реплик "
+            "не прерываются. После копирования сбрасываются кеши лент, "
+            "чтобы страницы, собранные из отстававших реплик, "
+            "не отдавались дальше.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', metavar='alias',
+                            help='Реплики (по умолчанию все)')
+
+    def handle(self, *args, aliases, **options):
+        unknown = set(aliases) - set(settings.DATABASE_REPLICAS)
+        if unknown:
+            raise CommandError(f'Не реплики: {", ".join(sorted(unknown))}')
+
+        primary = connections[DEFAULT_DB_ALIAS]
+        primary.ensure_connection()
+        for alias in aliases or settings.DATABASE_REPLICAS:
+            replica = connections[alias]
+            replica.ensure_connection()
+            primary.connection.backup(replica.connection)
+            replica.close()
+            self.stdout.write(f'{alias}: скопирована')
+
+        cache.bump(cache.GLOBAL)
@@ -0,0 +1,59 @@
+# Generated by Django 2.2.9 on 2026-10-17 05:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Follow = apps.get_model('posts', 'Follow')
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    comments = Post.objects.annotate(total=Count('comments')).filter(total__gt=0)
+    for post_id, total in comments.values_list('pk', 'total').iterator():
+        Post.objects.filter(pk=post_id).update(comments_count=total)
+
+    def totals(model, field):
+        rows = model.objects.values(field).annotate(total=Count('pk'))
+        return {row[field]: row['total'] for row in rows}
+
+    posts = totals(Post, 'author')
+    followers = totals(Follow, 'author')
+    following = totals(Follow, 'user')
+    AuthorStats.objects.bulk_create(
+        (AuthorStats(user_id=user_id,
+                     posts_count=posts.get(user_id, 0),
+                     followers_count=followers.get(user_id, 0),
+                     following_count=following.get(user_id, 0))
+         for user_id in User.objects.values_list('pk', flat=True).iterator()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0006_auto_20200728_0603'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('posts_count', models.PositiveIntegerField(default=0)),
+                ('followers_count', models.PositiveIntegerField(default=0)),
+                ('following_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE posts_post_fts USING fts5(
+    text,
+    group_title,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+INSERT INTO posts_post_fts (rowid, text, group_title)
+SELECT p.id, p.text, COALESCE(g.title, '')
+FROM posts_post p LEFT JOIN posts_group g ON g.id = p.group_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEX, 'DROP TABLE posts_post_fts;'),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.9 on 2026-10-17 06:54
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_references(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    StoredFile = apps.get_model('posts', 'StoredFile')
+    images = Post.objects.exclude(image='').exclude(image=None).values(
+        'image'
+    ).annotate(total=Count('pk')).order_by()
+    StoredFile.objects.bulk_create(
+        (StoredFile(name=row['image'], references=row['total'])
+         for row in images.iterator()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_post_rendered_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_references, migrations.RunPython.noop),
+    ]
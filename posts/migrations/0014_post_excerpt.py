@@ -0,0 +1,43 @@
+# Generated by Django 2.2.9 on 2026-10-17 06:58
+
+from django.db import migrations, models
+from django.template.defaultfilters import linebreaksbr
+
+# posts.models.PREVIEW_LENGTH на момент миграции
+EXCERPT_LENGTH = 200
+
+
+def fill_excerpts(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    posts = Post.objects.only('pk', 'text').order_by()
+    batch = []
+    for post in posts.iterator():
+        post.excerpt_html = linebreaksbr(post.text[:EXCERPT_LENGTH],
+                                         autoescape=True)
+        post.has_more = len(post.text) > EXCERPT_LENGTH
+        batch.append(post)
+        if len(batch) == 500:
+            Post.objects.bulk_update(batch, ['excerpt_html', 'has_more'])
+            batch = []
+    Post.objects.bulk_update(batch, ['excerpt_html', 'has_more'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_stored_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt_html',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='has_more',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.9 on 2026-10-17 07:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_heavy_authors(apps, schema_editor):
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    AuthorStats.objects.filter(
+        followers_count__gt=settings.FOLLOW_FANOUT_LIMIT
+    ).update(fanout=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_post_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorstats',
+            name='fanout',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(mark_heavy_authors, migrations.RunPython.noop),
+    ]
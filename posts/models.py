@@ -1,41 +1,113 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.template.defaultfilters import linebreaksbr
+from django.utils.text import Truncator
+
+from posts.storage import ContentAddressedStorage
 
 User = get_user_model()
 
+# Длина превью текста поста и начала текста в карточках лент
+PREVIEW_LENGTH = 200
+# Поля, которые заполняет Post.render_text
+RENDERED_FIELDS = ('text_html', 'preview', 'excerpt_html', 'has_more')
+
+
+def count_subquery(model, field):
+    """ Подзапрос COUNT(*) строк `model`, у которых `field` ссылается
+    на строку внешнего запроса """
+    rows = (model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'))
+    return Coalesce(Subquery(rows, output_field=models.IntegerField()), 0)
+
+
+class TransactionalModel(models.Model):
+    """ Сохранение объекта и обработчики post_save (счётчики)
+    выполняются в одной транзакции """
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200, db_index=True)
     slug = models.SlugField(unique=True)
-    description = models.TextField(blank=True, db_index=True)
+    description = models.TextField(blank=True)
 
     def __str__(self):
         return self.title
 
 
-class Post(models.Model):
+class Post(TransactionalModel):
     text = models.TextField()
     pub_date = models.DateTimeField("date published",
                                     auto_now_add=True,
                                     db_index=True)
+    # Индексы внешних ключей заменены составными индексами лент в Meta
     author = models.ForeignKey(User,
                                on_delete=models.CASCADE,
-                               related_name="posts")
+                               related_name="posts",
+                               db_index=False)
     group = models.ForeignKey(Group,
                               on_delete=models.SET_NULL,
                               blank=True, null=True,
-                              related_name="posts")
+                              related_name="posts",
+                              db_index=False)
     image = models.ImageField(upload_to='posts/',
+                              storage=ContentAddressedStorage(),
                               blank=True,
                               null=True)
+    comments_count = models.PositiveIntegerField(default=0,
+                                                 editable=False)
+    # Текст, подготовленный к выводу при сохранении (см. render_text)
+    text_html = models.TextField(default='', editable=False)
+    preview = models.CharField(max_length=PREVIEW_LENGTH, default='',
+                               editable=False)
+    excerpt_html = models.TextField(default='', editable=False)
+    has_more = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        # Ленты автора и группы: отбор и сортировка курсорной
+        # пагинации (-pub_date, -id) по одному индексу
+        indexes = [
+            models.Index(fields=["author", "-pub_date", "-id"]),
+            models.Index(fields=["group", "-pub_date", "-id"]),
+        ]
 
+    def render_text(self):
+        """ Экранированный текст с переносами строк для шаблонов,
+        его начало для карточек лент и короткое текстовое превью """
+        self.text_html = linebreaksbr(self.text, autoescape=True)
+        self.excerpt_html = linebreaksbr(self.text[:PREVIEW_LENGTH],
+                                         autoescape=True)
+        self.has_more = len(self.text) > PREVIEW_LENGTH
+        self.preview = Truncator(' '.join(self.text.split())).chars(
+            PREVIEW_LENGTH
+        )
 
-class Comment(models.Model):
+    def save(self, *args, **kwargs):
+        self.render_text()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'text' in update_fields:
+            kwargs['update_fields'] = {*update_fields, *RENDERED_FIELDS}
+        super().save(*args, **kwargs)
+
+
+class Comment(TransactionalModel):
     post = models.ForeignKey(Post,
                              on_delete=models.CASCADE,
                              blank=True,
                              null=True,
-                             related_name="comments")
+                             related_name="comments",
+                             db_index=False)
     author = models.ForeignKey(User,
                                on_delete=models.CASCADE,
                                related_name="comments")
@@ -43,11 +115,15 @@ class Comment(models.Model):
     created = models.DateTimeField("date published",
                                    auto_now_add=True)
 
+    class Meta:
+        # Комментарии поста, новые сверху
+        indexes = [models.Index(fields=["post", "-created", "-id"])]
+
     def __str__(self):
         return self.text
 
 
-class Follow(models.Model):
+class Follow(TransactionalModel):
     user = models.ForeignKey(User,
                              on_delete=models.CASCADE,
                              related_name="follower")
@@ -57,3 +133,84 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = (("user", "author"),)
+
+
+class TimelineEntry(models.Model):
+    """ Запись материализованной ленты подписок: пост автора,
+    на которого подписан пользователь """
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name="timeline")
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name="timeline_entries")
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name="+")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = (("user", "post"),)
+        indexes = [models.Index(fields=["user", "-pub_date", "-post"])]
+
+
+class AuthorStatsManager(models.Manager):
+    def with_actual_counts(self):
+        """ Пользователи с пересчитанными по таблицам значениями счётчиков """
+        return User.objects.annotate(
+            actual_posts=count_subquery(Post, 'author'),
+            actual_followers=count_subquery(Follow, 'author'),
+            actual_following=count_subquery(Follow, 'user'),
+        )
+
+    def recount(self, user_id):
+        """ Пересчитать счётчики пользователя и сохранить их """
+        actual = self.with_actual_counts().values(
+            'actual_posts', 'actual_followers', 'actual_following'
+        ).get(pk=user_id)
+        stats, _ = self.update_or_create(
+            user_id=user_id,
+            defaults={'posts_count': actual['actual_posts'],
+                      'followers_count': actual['actual_followers'],
+                      'following_count': actual['actual_following']}
+        )
+        return stats
+
+    def for_author(self, author):
+        """ Счётчики автора; строка создаётся, если её ещё нет """
+        try:
+            return author.stats
+        except self.model.DoesNotExist:
+            return self.recount(author.pk)
+
+
+class AuthorStats(models.Model):
+    """ Денормализованные счётчики пользователя """
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="stats")
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # Раскладываются ли посты автора по лентам подписчиков
+    # (см. posts/timeline.py)
+    fanout = models.BooleanField(default=True)
+
+    objects = AuthorStatsManager()
+
+    def __str__(self):
+        return str(self.user)
+
+
+class StoredFile(models.Model):
+    """ Число постов, ссылающихся на файл ContentAddressedStorage.
+
+    Строка файла ещё и блокировка: сохранение в хранилище и удаление
+    файла без ссылок захватывают её до конца транзакции (см. storage).
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    references = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
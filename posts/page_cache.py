@@ -0,0 +1,71 @@
+""" Кеш целых страниц для анонимных посетителей.
+
+Кешируются страницы представлений с декоратором `cache.conditional`:
+он сохраняет в `request.feed_versions` версии лент, из которых собрана
+страница. Эти ленты — суррогатные ключи страницы: вместе с ответом
+сохраняются их версии на момент чтения данных. Любое изменение поста,
+комментария, группы или подписки поднимает версии своих лент
+(`cache.bump`), и все страницы с этими ключами — и только они —
+перестают отдаваться из кеша.
+
+Попадание в кеш обслуживается до сессий, аутентификации и CSRF:
+одно чтение страницы и одно чтение версий, без запросов к базе.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from posts import cache
+
+
+def _page_key(request):
+    url = request.build_absolute_uri()
+    return f'page:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def _is_anonymous(request):
+    # Сессии ещё нет: её cookie отсутствует у всех, кто не входил на сайт
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def _is_cacheable(request, response):
+    return (getattr(request, 'feed_versions', None) is not None
+            and response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and 'private' not in response.get('Cache-Control', ''))
+
+
+class AnonymousPageCacheMiddleware:
+    """ Отдаёт анонимным посетителям сохранённые страницы лент """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in ('GET', 'HEAD') or not _is_anonymous(request):
+            return self.get_response(request)
+
+        pages = caches[settings.PAGE_CACHE]
+        key = _page_key(request)
+        entry = pages.get(key)
+        if entry is not None:
+            versions, response = entry
+            if cache.get_versions(*versions) == versions:
+                return self._conditional(request, response)
+
+        response = self.get_response(request)
+        if request.method == 'GET' and _is_cacheable(request, response):
+            pages.set(key, (request.feed_versions, response),
+                      settings.PAGE_CACHE_TIMEOUT)
+        return response
+
+    @staticmethod
+    def _conditional(request, response):
+        last_modified = parse_http_date_safe(response.get('Last-Modified', ''))
+        return get_conditional_response(
+            request, etag=response.get('ETag'),
+            last_modified=last_modified, response=response,
+        )
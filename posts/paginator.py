@@ -0,0 +1,192 @@
+import base64
+import binascii
+import json
+from collections.abc import Sequence
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+# Целые ключи, которые SQLite хранит в INTEGER (64 бита со знаком)
+MIN_INTEGER = -2 ** 63
+MAX_INTEGER = 2 ** 63 - 1
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _encode_value(value):
+    # DjangoJSONEncoder обрезает микросекунды, а для курсора
+    # нужно точное значение ключа
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {value!r} in a cursor')
+
+
+class CursorPage(Sequence):
+    """ Страница ленты, полученная по курсору.
+
+    Запрос выполняется при первом обращении к содержимому страницы,
+    поэтому при попадании в кеш фрагмента шаблона он не выполняется вовсе.
+    """
+    def __init__(self, paginator, loader):
+        self.paginator = paginator
+        self._loader = loader
+        self._result = None
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self)} items>'
+
+    def _load(self):
+        if self._result is None:
+            self._result = self._loader()
+        return self._result
+
+    @property
+    def object_list(self):
+        return self._load()[0]
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._load()[1]
+
+    def has_previous(self):
+        return self._load()[2]
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        return self.paginator.encode_cursor(NEXT, self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        return self.paginator.encode_cursor(PREVIOUS, self.object_list[0])
+
+
+class CursorPaginator:
+    """ Постраничный вывод по ключу (keyset pagination).
+
+    В отличие от `django.core.paginator.Paginator` не выполняет COUNT(*)
+    и не использует OFFSET: каждая страница — это диапазон по индексу
+    после (или перед) значениями ключа, записанными в непрозрачный курсор.
+    Порядок задаётся двумя полями: основным (например, `-pub_date`)
+    и уникальным полем, разрешающим совпадения (`-id`).
+    """
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = self.ordering[0].startswith('-')
+
+    def get_page(self, cursor=None):
+        """ Страница по курсору; при отсутствии или ошибке в курсоре
+        возвращается первая страница """
+        try:
+            direction, values = self.decode_cursor(cursor)
+        except InvalidCursor:
+            return CursorPage(self, self.first_page)
+
+        if direction == NEXT:
+            return CursorPage(self, lambda: self.page_after(values))
+        return CursorPage(self, lambda: self.page_before(values))
+
+    def first_page(self):
+        return self._page(self._fetch(), has_previous=False)
+
+    def page_after(self, values):
+        return self._page(self._fetch(values, forward=True),
+                          has_previous=True)
+
+    def page_before(self, values):
+        items = self._fetch(values, forward=False)
+        if len(items) <= self.per_page:
+            # Дошли до начала ленты: показываем полную первую страницу
+            return self.first_page()
+        items = items[:self.per_page]
+        items.reverse()
+        return items, True, True
+
+    def _fetch(self, values=None, forward=True):
+        """ До per_page + 1 объектов за курсором в направлении чтения """
+        rows = self.object_list
+        ordering = self.ordering
+        if values is not None:
+            rows = rows.filter(self._beyond(values, forward))
+        if not forward:
+            ordering = [self._flip(name) for name in ordering]
+        return list(rows.order_by(*ordering)[:self.per_page + 1])
+
+    def _page(self, items, has_previous):
+        """ Содержимое страницы: (объекты, has_next, has_previous) """
+        has_next = len(items) > self.per_page
+        return items[:self.per_page], has_next, has_previous
+
+    def _beyond(self, values, forward):
+        """ Условие «строго после курсора» в порядке ленты (или перед ним).
+
+        Записано как диапазон по основному полю с исключением совпадений,
+        чтобы SQLite мог использовать индекс вместо OR двух условий.
+        """
+        first, second = self.fields
+        first_value, second_value = values
+        lower = forward == self.descending
+        near, far = ('lte', 'gte') if lower else ('gte', 'lte')
+        same_first = Q(**{first: first_value,
+                          f'{second}__{far}': second_value})
+        return Q(**{f'{first}__{near}': first_value}) & ~same_first
+
+    @staticmethod
+    def _flip(name):
+        return name[1:] if name.startswith('-') else f'-{name}'
+
+    def encode_cursor(self, direction, obj):
+        values = [getattr(obj, name) for name in self.fields]
+        raw = json.dumps([direction] + values, default=_encode_value)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def _field(self, name):
+        """ Поле модели или аннотации, по которому идёт сортировка """
+        annotation = self.object_list.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return self.object_list.model._meta.get_field(name)
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            raise InvalidCursor
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, *raw_values = json.loads(
+                base64.urlsafe_b64decode(padded.encode())
+            )
+            if (direction not in (NEXT, PREVIOUS)
+                    or len(raw_values) != len(self.fields)):
+                raise InvalidCursor
+            values = [self._field(name).to_python(value)
+                      for name, value in zip(self.fields, raw_values)]
+        except (ValueError, TypeError, OverflowError, binascii.Error,
+                ValidationError):
+            raise InvalidCursor
+        if None in values:
+            raise InvalidCursor
+        if any(isinstance(value, int)
+               and not MIN_INTEGER <= value <= MAX_INTEGER
+               for value in values):
+            # Иначе запрос упадёт при передаче значения в базу
+            raise InvalidCursor
+        return direction, values
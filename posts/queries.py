@@ -0,0 +1,69 @@
+""" Запросы лент постов.
+
+Все ленты строятся здесь, чтобы карточка поста (`includes/post_item.html`)
+получала автора и группу одним запросом вместе с постами, начало текста,
+подготовленное при сохранении, вместо полного текста, а число
+комментариев — из денормализованного поля `Post.comments_count`.
+Количество запросов на страницу ленты не зависит от числа постов.
+"""
+from posts import timeline
+from posts.models import Comment, Post
+
+# Колонки связанных таблиц, которые карточка поста не выводит
+DEFERRED_FIELDS = (
+    'author__password',
+    'author__last_login',
+    'author__is_superuser',
+    'author__email',
+    'author__is_staff',
+    'author__is_active',
+    'author__date_joined',
+    'group__description',
+)
+
+
+def feed(queryset, excerpt=True):
+    """ Подготовить запрос ленты к выводу карточек постов.
+
+    Полный текст не загружается: карточка выводит `excerpt_html`,
+    а если текст длиннее (`has_more`) — ссылку «Читать далее».
+    API и RSS, которым нужен полный текст, передают `excerpt=False`.
+    """
+    queryset = queryset.select_related('author', 'group').defer(
+        *DEFERRED_FIELDS
+    )
+    if not excerpt:
+        return queryset
+    return queryset.defer('text', 'text_html', 'preview')
+
+
+def index_feed(excerpt=True):
+    return feed(Post.objects.all(), excerpt)
+
+
+def group_feed(group, excerpt=True):
+    return feed(group.posts.all(), excerpt)
+
+
+def author_feed(author, excerpt=True):
+    return feed(author.posts.all(), excerpt)
+
+
+def follow_feed(user, excerpt=True):
+    """ Лента подписок; сортируется по timeline.FEED_ORDERING """
+    return feed(timeline.follow_feed(user), excerpt)
+
+
+def post_detail():
+    return Post.objects.select_related('author', 'group')
+
+
+# Порядок комментариев поста для курсорной пагинации
+COMMENT_ORDERING = ('-created', '-id')
+
+
+def post_comments(post_id):
+    """ Комментарии поста с именами авторов одним запросом """
+    return Comment.objects.filter(post_id=post_id).select_related(
+        'author'
+    ).only('text', 'created', 'author', 'author__username')
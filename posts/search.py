@@ -0,0 +1,135 @@
+""" Полнотекстовый поиск по постам (SQLite FTS5).
+
+Индекс `posts_post_fts` хранит текст поста и название его группы,
+`rowid` строки индекса совпадает с id поста. Индекс обновляется
+обработчиками сигналов (см. posts/signals.py) в той же транзакции,
+что и сам пост. Результаты упорядочены по релевантности (bm25).
+"""
+import re
+
+from django.db import connection, models
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from posts import queries
+from posts.models import Post
+from posts.paginator import CursorPaginator
+
+TABLE = 'posts_post_fts'
+# Символы, которыми snippet() отмечает совпадения; в тексте их не бывает
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+SNIPPET_TOKENS = 24
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def match_expression(query):
+    """ Выражение MATCH из пользовательского запроса.
+
+    Синтаксис FTS5 пользователю не доступен: каждое слово ищется
+    как префикс (для словоформ), все слова должны встретиться.
+    Пустая строка означает, что искать нечего.
+    """
+    return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(query))
+
+
+def index_post(post_id):
+    """ Добавить пост в индекс или обновить его строку """
+    index_posts([post_id])
+
+
+def index_posts(post_ids):
+    """ Проиндексировать пачку постов одним запросом """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {TABLE} (rowid, text, group_title) '
+            'SELECT p.id, p.text, COALESCE(g.title, \'\') '
+            'FROM posts_post p LEFT JOIN posts_group g ON g.id = p.group_id '
+            f'WHERE p.id IN ({", ".join(["%s"] * len(post_ids))})',
+            list(post_ids),
+        )
+
+
+def unindex_post(post_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post_id])
+
+
+def set_group_title(group_id, title):
+    """ Обновить название группы у всех её постов в индексе """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {TABLE} SET group_title = %s WHERE rowid IN '
+            '(SELECT id FROM posts_post WHERE group_id = %s)',
+            [title, group_id],
+        )
+
+
+def matching_ids(query):
+    """ Подзапрос id постов, подходящих под запрос, для `pk__in` """
+    return models.expressions.RawSQL(
+        f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s',
+        [match_expression(query)],
+    )
+
+
+def highlight(snippet):
+    """ HTML фрагмента с выделенными совпадениями """
+    html = escape(snippet)
+    html = html.replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+    return mark_safe(html)
+
+
+class SearchPaginator(CursorPaginator):
+    """ Постраничный вывод результатов поиска по релевантности.
+
+    Ключ страницы — пара (rank, id), поэтому переход по страницам
+    не требует OFFSET и COUNT(*) по всем совпадениям. Постам
+    добавляются атрибуты `search_rank` и `snippet`.
+    """
+    FIELDS = {'search_rank': models.FloatField(), 'id': models.IntegerField()}
+
+    def __init__(self, query, per_page):
+        super().__init__(Post.objects.none(), per_page,
+                         ordering=('search_rank', '-id'))
+        self.expression = match_expression(query)
+
+    def _field(self, name):
+        return self.FIELDS[name]
+
+    def _fetch(self, values=None, forward=True):
+        if not self.expression:
+            return []
+
+        conditions = [f'{TABLE} MATCH %s']
+        params = [self.expression]
+        if values is not None:
+            rank, post_id = values
+            rank_op, id_op = ('>', '<') if forward else ('<', '>')
+            conditions.append(
+                f'(rank {rank_op} %s OR (rank = %s AND rowid {id_op} %s))'
+            )
+            params += [rank, rank, post_id]
+        order = 'rank, rowid DESC' if forward else 'rank DESC, rowid'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, rank, snippet({TABLE}, 0, %s, %s, %s, %s) '
+                f'FROM {TABLE} WHERE {" AND ".join(conditions)} '
+                f'ORDER BY {order} LIMIT %s',
+                [MATCH_START, MATCH_END, '…', SNIPPET_TOKENS]
+                + params + [self.per_page + 1],
+            )
+            rows = cursor.fetchall()
+
+        posts = queries.feed(Post.objects.all()).in_bulk(
+            [post_id for post_id, _, _ in rows]
+        )
+        results = []
+        for post_id, rank, snippet in rows:
+            post = posts.get(post_id)
+            if post is not None:
+                post.search_rank = rank
+                post.snippet = highlight(snippet)
+                results.append(post)
+        return results
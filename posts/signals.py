@@ -0,0 +1,163 @@
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from posts import cache, search, storage, timeline
+from posts.models import AuthorStats, Comment, Follow, Group, Post, User
+
+
+def change_counter(user_id, field, delta):
+    """ Атомарно изменить счётчик пользователя на `delta`.
+
+    При увеличении отсутствующая строка счётчиков создаётся пересчётом.
+    Уменьшение никогда не создаёт строк и не опускает счётчик ниже нуля
+    (в том числе при каскадном удалении пользователя) — такие расхождения
+    исправляет команда `recount`.
+    """
+    rows = AuthorStats.objects.filter(user_id=user_id)
+    if delta < 0:
+        rows = rows.filter(**{f'{field}__gte': -delta})
+    updated = rows.update(**{field: F(field) + delta})
+    if not updated and delta > 0:
+        AuthorStats.objects.recount(user_id)
+
+
+@receiver(post_save, sender=User)
+def create_author_stats(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        AuthorStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    # Имя пользователя выводится на его страницах; вход на сайт
+    # меняет только last_login, который нигде не показывается
+    if not created and update_fields != frozenset(['last_login']):
+        cache.bump(cache.author_scope(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    cache.bump(cache.author_scope(instance.pk))
+
+
+def bump_post_feeds(post_id):
+    """ Обновить версии лент, в которых виден пост """
+    post = Post.objects.filter(pk=post_id).only('author', 'group').first()
+    if post is None:
+        cache.bump(cache.post_scope(post_id))
+    else:
+        cache.bump(*cache.post_scopes(post))
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_values(sender, instance, raw, **kwargs):
+    # При переносе поста в другую группу нужно обновить и старую группу,
+    # а при замене изображения — освободить старый файл
+    instance._previous_group_id = None
+    instance._previous_image = None
+    if instance.pk is not None and not instance._state.adding:
+        previous = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'image'
+        ).first()
+        if previous is not None:
+            (instance._previous_group_id,
+             instance._previous_image) = previous
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        change_counter(instance.author_id, 'posts_count', 1)
+        timeline.fan_out(instance)
+    search.index_post(instance.pk)
+
+    scopes = cache.post_scopes(instance)
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id is not None:
+        scopes.append(cache.group_scope(previous_group_id))
+    cache.bump(*scopes)
+
+    previous_image = getattr(instance, '_previous_image', None)
+    if (previous_image or None) != (instance.image.name or None):
+        storage.acquire(instance.image.name)
+        storage.release(previous_image, Post)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    change_counter(instance.author_id, 'posts_count', -1)
+    cache.bump(*cache.post_scopes(instance))
+    search.unindex_post(instance.pk)
+    storage.release(instance.image.name, Post)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw, **kwargs):
+    if instance.post_id is None:
+        return
+    if created and not raw:
+        Post.objects.filter(pk=instance.post_id).update(
+            comments_count=F('comments_count') + 1
+        )
+    bump_post_feeds(instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        Post.objects.filter(pk=instance.post_id,
+                            comments_count__gt=0).update(
+            comments_count=F('comments_count') - 1
+        )
+        bump_post_feeds(instance.post_id)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    # Название группы выводится в карточках постов во всех лентах
+    if created:
+        cache.bump(cache.group_scope(instance.pk))
+    else:
+        cache.bump(cache.GLOBAL, cache.group_scope(instance.pk))
+        search.set_group_title(instance.pk, instance.title)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # Посты группы останутся без неё; после удаления их уже не найти
+    search.set_group_title(instance.pk, '')
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    cache.bump(cache.GLOBAL, cache.group_scope(instance.pk))
+
+
+def bump_follow_scopes(follow):
+    # Счётчики подписок выводятся на страницах обоих пользователей
+    cache.bump(cache.author_scope(follow.author_id),
+               cache.author_scope(follow.user_id))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        change_counter(instance.author_id, 'followers_count', 1)
+        change_counter(instance.user_id, 'following_count', 1)
+        timeline.stop_fanout(instance.author_id)
+        timeline.backfill(instance.user_id, instance.author_id)
+        bump_follow_scopes(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    change_counter(instance.author_id, 'followers_count', -1)
+    change_counter(instance.user_id, 'following_count', -1)
+    timeline.remove(instance.user_id, instance.author_id)
+    # У автора стало мало подписчиков: его посты снова раскладываются
+    # по лентам. После фиксации, чтобы при удалении самого автора
+    # не раскладывать удаляемые посты
+    timeline.schedule_resume_fanout(instance.author_id)
+    bump_follow_scopes(instance)
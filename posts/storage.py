@@ -0,0 +1,105 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+from sorl import thumbnail
+from sorl.thumbnail.images import ImageFile
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """ Хранилище, в котором имя файла — SHA-256 его содержимого.
+
+    Одинаковые изображения, загруженные разными пользователями, хранятся
+    одним файлом `posts/ab/abcdef….jpg`, поэтому и миниатюры sorl для них
+    создаются один раз. Ссылки на файл считаются в строке StoredFile
+    (`acquire` и `release`), и файл удаляется вместе с последней.
+    """
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(posixpath.dirname(name), digest[:2],
+                              f'{digest}{extension}')
+        with transaction.atomic():
+            # Пока транзакция не зафиксирована, файл не удалит `release`
+            # другого запроса, даже если сейчас на него никто не ссылается
+            lock(name)
+            if self.exists(name):
+                return name
+            return super().save(name, content, max_length=max_length)
+
+
+def lock(name):
+    """ Захватить строку файла до конца транзакции, создав её """
+    from posts.models import StoredFile
+
+    # UPDATE без изменений блокирует строку (в SQLite — всю базу)
+    if StoredFile.objects.filter(name=name).update(
+            references=F('references')):
+        return
+    try:
+        with transaction.atomic():
+            StoredFile.objects.create(name=name)
+    except IntegrityError:
+        # Строку одновременно создал другой запрос
+        StoredFile.objects.filter(name=name).update(
+            references=F('references'))
+
+
+def acquire(name, count=1):
+    """ Учесть `count` новых ссылок на файл """
+    from posts.models import StoredFile
+
+    if not name:
+        return
+    lock(name)
+    StoredFile.objects.filter(name=name).update(
+        references=F('references') + count)
+
+
+def release(name, model, field='image'):
+    """ Снять ссылку на файл; без ссылок удалить его и миниатюры.
+
+    Удаление выполняется после фиксации транзакции: при откате ссылка
+    на файл в базе сохранится, и файл должен остаться.
+    """
+    from posts.models import StoredFile
+
+    storage = model._meta.get_field(field).storage
+    if not name:
+        return
+    try:
+        storage.path(name)
+    except SuspiciousFileOperation:
+        # Файл вне MEDIA_ROOT хранилищу не принадлежит
+        return
+    StoredFile.objects.filter(name=name, references__gt=0).update(
+        references=F('references') - 1)
+
+    def delete_unreferenced():
+        with transaction.atomic():
+            # Удалённая строка заблокирована до фиксации: `save` того же
+            # файла в другом запросе дождётся её и запишет файл заново
+            deleted, _ = StoredFile.objects.filter(name=name,
+                                                   references=0).delete()
+            if deleted:
+                thumbnail.delete(ImageFile(name, storage),
+                                 delete_file=False)
+                storage.delete(name)
+
+    transaction.on_commit(delete_unreferenced)
@@ -0,0 +1,24 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+def image_context(post):
+    """ Изображение поста с готовыми миниатюрами в srcset;
+    пока миниатюр нет, выводится исходное изображение """
+    variants = thumbnails.cached_variants(post.image)
+    if not variants:
+        return {'src': post.image.url, 'srcset': ''}
+
+    # Для браузеров без srcset — миниатюра ширины карточки
+    src = next((thumb for width, thumb in variants if width >= 960),
+               variants[-1][1])
+    srcset = ', '.join(f'{thumb.url} {width}w' for width, thumb in variants)
+    return {'src': src.url, 'srcset': srcset}
+
+
+@register.inclusion_tag('includes/post_image.html')
+def post_image(post):
+    return image_context(post)
@@ -1,11 +1,46 @@
+import base64
+import importlib.util
+import json
+import os
+import re
+import sqlite3
 import tempfile
-
-from django.core.cache import cache
+import threading
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.cache import cache, caches
 from django.core.cache.backends import locmem
-from django.test import Client, TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
+
+from posts import checks, thumbnails, timeline, urls
+from posts.cache import INDEX, get_versions
+from posts.models import (AuthorStats, Comment, Follow, Group, Post,
+                          StoredFile, TimelineEntry, User)
+from posts.paginator import NEXT, CursorPaginator, InvalidCursor
+from yatube import metrics, routers, slow_queries
+
 
-from posts.models import Follow, Group, Post, User
+@contextmanager
+def committed():
+    """ Выполнить on_commit, добавленные внутри блока, как после фиксации:
+    TestCase Django 2.2 транзакцию не фиксирует и сам их не вызывает """
+    start = len(connection.run_on_commit)
+    yield
+    # Выполнить и те, что добавят сами вызванные функции
+    while len(connection.run_on_commit) > start:
+        _, callback = connection.run_on_commit.pop(start)
+        callback()
 
 
 class ProfileTest(TestCase):
@@ -476,3 +511,1615 @@ class TestComments(TestCase):
                                    status_code=200)
         except Exception as e:
             assert False, f'''Комментарий найден. Ошибка: `{e}`'''
+
+
+@override_settings(COMMENTS_PAGE_SIZE=20)
+class TestCommentPages(TestCase):
+    """ Тесты постраничного вывода комментариев """
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username="author", email="author@emeil.com", password="12345"
+        )
+        self.post = Post.objects.create(text="Пост", author=self.author)
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.author,
+                    text=f"Комментарий {i}")
+            for i in range(25)
+        )
+        self.kwargs = {'username': 'author', 'post_id': self.post.pk}
+
+    def comment_texts(self, response):
+        return [comment.text for comment in response.context['comments_page']]
+
+    def test_first_page_and_load_more(self):
+        response = self.client.get(reverse('post', kwargs=self.kwargs))
+        texts = self.comment_texts(response)
+        self.assertEqual(len(texts), 20)
+        page = response.context['comments_page']
+        self.assertContains(response, 'Показать ещё комментарии')
+
+        fragment = self.client.get(reverse('post_comments',
+                                           kwargs=self.kwargs),
+                                   {'cursor': page.next_cursor})
+        rest = self.comment_texts(fragment)
+        self.assertEqual(len(rest), 5)
+        self.assertEqual(set(texts) | set(rest),
+                         {f"Комментарий {i}" for i in range(25)})
+        self.assertNotContains(fragment, 'Показать ещё комментарии')
+        self.assertNotContains(fragment, '<html')
+
+    def test_wrong_author(self):
+        User.objects.create_user(username="other", password="12345")
+        response = self.client.get(reverse('post_comments', kwargs={
+            'username': 'other', 'post_id': self.post.pk,
+        }))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestRenderedText(TestCase):
+    """ Тесты текста поста, подготовленного при сохранении """
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username="author", email="author@emeil.com", password="12345"
+        )
+        self.client.force_login(self.author)
+
+    def test_rendered_on_save_and_edit(self):
+        self.client.post(reverse('new_post'),
+                         {'text': 'Первая <b>строка</b>\nвторая'})
+        post = Post.objects.get()
+        self.assertEqual(post.text_html,
+                         'Первая &lt;b&gt;строка&lt;/b&gt;<br>вторая')
+        self.assertEqual(post.preview, 'Первая <b>строка</b> вторая')
+
+        with committed():
+            self.client.post(reverse('post_edit', kwargs={
+                'username': 'author', 'post_id': post.pk,
+            }), {'text': 'Новый\nтекст'})
+        post.refresh_from_db()
+        self.assertEqual(post.text_html, 'Новый<br>текст')
+
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Новый<br>текст')
+
+    def test_update_fields(self):
+        post = Post.objects.create(text="Старый", author=self.author)
+        post.text = "Новый"
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertEqual((post.text_html, post.preview), ("Новый", "Новый"))
+        self.assertEqual(post.excerpt_html, "Новый")
+
+    def test_feed_excerpt(self):
+        """ Ленты выводят начало текста, подготовленное при сохранении,
+        и не читают из базы полный текст """
+        Post.objects.create(text="Короткий", author=self.author)
+        long_text = "Начало\n" + "слово " * 40 + "Конец"
+        post = Post.objects.create(text=long_text, author=self.author)
+        self.assertTrue(post.has_more)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        feed_sql = next(query['sql'] for query in queries
+                        if 'excerpt_html' in query['sql'])
+        self.assertNotIn('"posts_post"."text",', feed_sql)
+        self.assertNotIn('"posts_post"."text_html"', feed_sql)
+        self.assertContains(response, 'Короткий')
+        self.assertContains(response, 'Начало<br>слово')
+        self.assertNotContains(response, 'Конец')
+        self.assertContains(response, 'Читать далее', count=1)
+
+        response = self.client.get(reverse('post', kwargs={
+            'username': 'author', 'post_id': post.pk,
+        }))
+        self.assertContains(response, 'Конец')
+        self.assertNotContains(response, 'Читать далее')
+
+    def test_backfill(self):
+        post = Post.objects.create(text="Текст\nпоста", author=self.author)
+        Post.objects.update(text_html='', preview='', excerpt_html='')
+
+        call_command('render_posts', stdout=StringIO())
+
+        post.refresh_from_db()
+        self.assertEqual(post.text_html, 'Текст<br>поста')
+        self.assertEqual(post.preview, 'Текст поста')
+        self.assertEqual(post.excerpt_html, 'Текст<br>поста')
+
+
+class TestCounters(TestCase):
+    """ Тесты денормализованных счётчиков """
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username="author", email="author@emeil.com", password="12345"
+        )
+        self.reader = User.objects.create_user(
+            username="reader", email="reader@emeil.com", password="54321"
+        )
+        self.post = Post.objects.create(text="Проверка счётчиков",
+                                        author=self.author)
+
+    def stats(self, user):
+        return AuthorStats.objects.get(user=user)
+
+    def test_counters_follow_changes(self):
+        """ Счётчики меняются при создании и удалении
+        постов, комментариев и подписок """
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text="Комментарий")
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+
+        self.post.comments.all().delete()
+        follow.delete()
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+
+        self.post.delete()
+        self.assertEqual(self.stats(self.author).posts_count, 0)
+
+    def test_profile_without_count_queries(self):
+        """ Счётчики профиля читаются вместе с автором,
+        без COUNT(*) по постам и подпискам """
+        url = reverse('profile', kwargs={'username': self.author.username})
+        # id автора для ETag, автор со счётчиками, посты
+        with self.assertNumQueries(3):
+            response = Client().get(url)
+        self.assertEqual(response.context['count'], 1)
+
+    def test_recount_repairs_drift(self):
+        """ Команда recount исправляет расхождения счётчиков """
+        AuthorStats.objects.filter(user=self.author).update(posts_count=7)
+        AuthorStats.objects.filter(user=self.reader).delete()
+        Post.objects.filter(pk=self.post.pk).update(comments_count=3)
+
+        call_command('recount', stdout=StringIO())
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertTrue(AuthorStats.objects.filter(user=self.reader).exists())
+
+
+class TestImportJsonl(TestCase):
+    """ Тесты команды import_jsonl """
+    RECORDS = [
+        {'type': 'user', 'username': 'writer'},
+        {'type': 'user', 'username': 'reader'},
+        {'type': 'group', 'slug': 'cats', 'title': 'Котики'},
+        {'type': 'post', 'id': 100, 'author': 'writer', 'group': 'cats',
+         'text': 'Импортированный пост', 'pub_date': '2019-05-01T10:00:00Z'},
+        {'type': 'post', 'id': 101, 'author': 'nobody',
+         'text': 'Пост без автора', 'pub_date': '2019-05-02T10:00:00Z'},
+        {'type': 'comment', 'post': 100, 'author': 'reader',
+         'text': 'Комментарий', 'created': '2019-05-03T10:00:00Z'},
+        {'type': 'follow', 'user': 'reader', 'author': 'writer'},
+    ]
+
+    def test_import(self):
+        """ Данные загружаются с исходными датами, а счётчики, лента
+        подписок и поиск приводятся в порядок """
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as source:
+            for record in self.RECORDS:
+                source.write(json.dumps(record) + '\n')
+            source.flush()
+            call_command('import_jsonl', source.name, batch_size=2,
+                         stdout=StringIO())
+
+        post = Post.objects.get(pk=100)
+        writer = User.objects.get(username='writer')
+        reader = User.objects.get(username='reader')
+        self.assertEqual(post.author, writer)
+        self.assertEqual(post.group.slug, 'cats')
+        self.assertEqual(post.pub_date.year, 2019)
+        self.assertFalse(Post.objects.filter(pk=101).exists())
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(writer.stats.posts_count, 1)
+        self.assertEqual(writer.stats.followers_count, 1)
+        self.assertEqual(reader.stats.following_count, 1)
+        self.assertTrue(TimelineEntry.objects.filter(user=reader,
+                                                     post=post).exists())
+        response = Client().get(reverse('search'), {'q': 'котики'})
+        self.assertEqual(list(response.context['page']), [post])
+
+    def import_records(self, records):
+        stdout = StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as source:
+            for record in records:
+                source.write(json.dumps(record) + '\n')
+            source.flush()
+            call_command('import_jsonl', source.name, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_invalid_records(self):
+        """ Запись без обязательного поля или с неразобранной датой
+        отклоняется с указанием файла и строки """
+        for record, message in (
+                ({'type': 'post', 'id': 1, 'author': 'writer',
+                  'pub_date': '2019-05-01T10:00:00Z'}, 'нет поля text'),
+                ({'type': 'comment', 'post': 1, 'author': 'writer',
+                  'text': 'Текст', 'created': 'вчера'},
+                 'не удалось разобрать дату created')):
+            with self.subTest(message=message):
+                with self.assertRaisesRegex(CommandError,
+                                            rf'\.jsonl:2: {message}'):
+                    self.import_records([self.RECORDS[0], record])
+        self.assertFalse(User.objects.exists())
+
+    def test_repeated_import(self):
+        """ Повторно загруженные записи не считаются сохранёнными,
+        а даты после загрузки снова проставляются автоматически """
+        self.import_records(self.RECORDS)
+        output = self.import_records(self.RECORDS)
+
+        self.assertIn('user: 0, group: 0, post: 0, comment: 1, follow: 0',
+                      output)
+        self.assertIn('Пропущено записей, уже загруженных или со ссылками '
+                      'на отсутствующие объекты: 6', output)
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+        self.assertTrue(Comment._meta.get_field('created').auto_now_add)
+
+        # Счётчики обновлены вместе с пачками, без пересчёта
+        self.assertEqual(Post.objects.get(pk=100).comments_count, 2)
+        self.assertEqual(AuthorStats.objects.get(
+            user__username='writer'
+        ).posts_count, 1)
+        output = StringIO()
+        call_command('recount', dry_run=True, verbosity=0, stdout=output)
+        self.assertIn('постов 0, авторов 0', output.getvalue())
+
+
+class TestSeedAndBenchmark(TestCase):
+    """ Тесты команд seed и benchmark """
+    def test_seed_and_benchmark(self):
+        """ Синтетические данные скошены к популярным авторам,
+        а benchmark измеряет каждую страницу и не меняет базу """
+        call_command('seed', users=50, groups=3, posts=300, comments=200,
+                     follows=200, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 300)
+        top = AuthorStats.objects.order_by('-posts_count')[0]
+        self.assertGreater(top.posts_count, 300 / 50 * 3)
+        follows = Follow.objects.count()
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark', repeat=2, output=output.name,
+                         stdout=StringIO())
+            results = json.load(output)['results']
+
+        self.assertEqual(set(results),
+                         {pattern.name for pattern in urls.urlpatterns})
+        self.assertEqual(results['index']['status'], [200])
+        self.assertGreater(results['index']['bytes'], 0)
+        self.assertEqual(Follow.objects.count(), follows)
+
+    def test_benchmark_without_posts(self):
+        """ Без постов у автора benchmark сообщает об ошибке """
+        User.objects.create_user(username="author")
+        Group.objects.create(title="Группа", slug="group")
+        with self.assertRaisesRegex(CommandError, 'нет постов'):
+            call_command('benchmark', repeat=1, stdout=StringIO())
+
+
+class TestCursorPaginator(TestCase):
+    """ Тесты постраничного вывода по курсору """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="test_user", email="test_user@emeil.com", password="12345"
+        )
+        self.posts = [Post.objects.create(text=f"Пост {i}", author=self.user)
+                      for i in range(25)]
+        # Одинаковая дата у части постов: порядок решает id
+        Post.objects.filter(pk__in=[p.pk for p in self.posts[5:15]]).update(
+            pub_date=self.posts[5].pub_date
+        )
+
+    def test_walk_forward_and_back(self):
+        """ Переход вперёд и назад по курсорам возвращает
+        все посты без пропусков и повторов """
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        expected = list(Post.objects.order_by('-pub_date', '-id'))
+
+        pages = [paginator.get_page(None)]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([post for page in pages for post in page], expected)
+        self.assertFalse(pages[0].has_previous())
+
+        back = paginator.get_page(pages[2].previous_cursor)
+        self.assertEqual(list(back), list(pages[1]))
+        first = paginator.get_page(back.previous_cursor)
+        self.assertEqual(list(first), list(pages[0]))
+        self.assertFalse(first.has_previous())
+
+    def test_single_query_per_page(self):
+        """ Страница читается одним запросом, без COUNT(*) """
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        cursor = paginator.get_page(None).next_cursor
+        with self.assertNumQueries(1):
+            page = paginator.get_page(cursor)
+            list(page)
+
+    def test_invalid_cursor(self):
+        """ Испорченный курсор открывает первую страницу """
+        response = Client().get(reverse('index'), {'cursor': 'испорчен'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['page'].has_previous())
+
+    def test_out_of_range_cursor(self):
+        """ Курсор с числом вне диапазона базы открывает первую страницу
+        (а не завершается ошибкой сервера) """
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        date = self.posts[0].pub_date.isoformat()
+        for key in ('1e400', str(2 ** 63), str(-2 ** 63 - 1)):
+            raw = f'["{NEXT}", "{date}", {key}]'.encode()
+            cursor = base64.urlsafe_b64encode(raw).decode()
+            with self.subTest(key=key):
+                with self.assertRaises(InvalidCursor):
+                    paginator.decode_cursor(cursor)
+                response = Client().get(reverse('index'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.context['page'].has_previous())
+
+
+class TestTimeline(TestCase):
+    """ Тесты материализованной ленты подписок """
+    def setUp(self):
+        self.reader_client = Client()
+        self.author = User.objects.create_user(
+            username="author", email="author@emeil.com", password="12345"
+        )
+        self.reader = User.objects.create_user(
+            username="reader", email="reader@emeil.com", password="54321"
+        )
+        self.old_post = Post.objects.create(text="Старый пост",
+                                            author=self.author)
+        self.reader_client.login(username="reader", password="54321")
+
+    def feed_texts(self):
+        response = self.reader_client.get(reverse('follow_index'))
+        return [post.text for post in response.context['page']]
+
+    def test_follow_backfill_and_unfollow(self):
+        """ Подписка добавляет в ленту старые посты автора,
+        новые посты раскладываются при публикации,
+        отписка убирает посты автора из ленты """
+        self.reader_client.get(reverse('profile_follow',
+                                       kwargs={'username': 'author'}))
+        Post.objects.create(text="Новый пост", author=self.author)
+
+        self.assertEqual(self.feed_texts(), ["Новый пост", "Старый пост"])
+
+        self.reader_client.get(reverse('profile_unfollow',
+                                       kwargs={'username': 'author'}))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader))
+        self.assertEqual(self.feed_texts(), [])
+
+    @override_settings(FOLLOW_TIMELINE_LENGTH=3)
+    def test_timeline_is_trimmed(self):
+        """ Лента пользователя ограничена по длине """
+        for i in range(5):
+            Post.objects.create(text=f"Пост {i}", author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader)
+                         .count(), 3)
+        self.assertEqual(self.feed_texts(), ["Пост 4", "Пост 3", "Пост 2"])
+
+    @override_settings(FOLLOW_FANOUT_LIMIT=2, FOLLOW_FANOUT_HYSTERESIS=1,
+                       TIMELINE_WORKERS=0)
+    def test_posts_kept_when_author_gets_light(self):
+        """ Посты, опубликованные при большом числе подписчиков,
+        раскладываются по лентам, только когда подписчиков становится
+        меньше предела на FOLLOW_FANOUT_HYSTERESIS """
+        Follow.objects.create(user=self.reader, author=self.author)
+        follows = [
+            Follow.objects.create(
+                user=User.objects.create_user(username=f"other{i}"),
+                author=self.author,
+            )
+            for i in range(2)
+        ]
+        self.assertFalse(timeline.is_fanout_author(self.author.pk))
+        Post.objects.create(text="Новый пост", author=self.author)
+        self.assertEqual(self.feed_texts(), ["Новый пост", "Старый пост"])
+
+        # Подписчиков столько же, сколько предел: раскладка не включается
+        with committed():
+            follows[0].delete()
+        self.assertFalse(timeline.is_fanout_author(self.author.pk))
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader)
+                         .count(), 1)
+        self.assertEqual(self.feed_texts(), ["Новый пост", "Старый пост"])
+
+        with committed():
+            follows[1].delete()
+        self.assertTrue(timeline.is_fanout_author(self.author.pk))
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader)
+                         .count(), 2)
+        self.assertEqual(self.feed_texts(), ["Новый пост", "Старый пост"])
+
+    @override_settings(FOLLOW_FANOUT_LIMIT=0)
+    def test_heavy_author_read_through(self):
+        """ Посты авторов с большим числом подписчиков
+        не раскладываются, но попадают в ленту при чтении """
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(text="Новый пост", author=self.author)
+
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader))
+        self.assertEqual(self.feed_texts(), ["Новый пост", "Старый пост"])
+        self.assertEqual(timeline.follow_feed(self.reader).count(), 2)
+
+
+class TestFeedCache(TestCase):
+    """ Тесты версионированного кеша фрагментов лент """
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="test_user", email="test_user@emeil.com", password="12345"
+        )
+        self.group = Group.objects.create(title='test_group',
+                                          slug='test_group')
+        for i in range(15):
+            Post.objects.create(text=f"Пост номер {i}.", author=self.user,
+                                group=self.group)
+
+    def test_pages_are_cached_separately(self):
+        """ Вторая страница не берётся из кеша первой """
+        first = self.client.get(reverse('index'))
+        cursor = first.context['page'].next_cursor
+        second = self.client.get(reverse('index'), {'cursor': cursor})
+
+        self.assertContains(first, "Пост номер 14.")
+        self.assertContains(second, "Пост номер 4.")
+        self.assertNotContains(second, "Пост номер 14.")
+
+    def test_changes_invalidate_feeds(self):
+        """ Новый пост и комментарий сразу видны в закешированных лентах """
+        urls = [reverse('index'),
+                reverse('group_posts', kwargs={'slug': self.group.slug}),
+                reverse('profile', kwargs={'username': self.user.username})]
+        for url in urls:
+            self.client.get(url)
+
+        with committed():
+            post = Post.objects.create(text="Свежий пост", author=self.user,
+                                       group=self.group)
+        for url in urls:
+            self.assertContains(self.client.get(url), "Свежий пост")
+
+        with committed():
+            Comment.objects.create(post=post, author=self.user, text="Ответ")
+        for url in urls:
+            self.assertContains(self.client.get(url), "1 комментариев")
+
+    def test_version_bumped_after_commit(self):
+        """ Версия ленты меняется только после фиксации транзакции:
+        иначе читатель закеширует старые строки под новой версией """
+        before = get_versions(INDEX)[INDEX]
+        with committed():
+            Post.objects.create(text="Свежий пост", author=self.user)
+            self.assertEqual(get_versions(INDEX)[INDEX], before)
+        self.assertGreater(get_versions(INDEX)[INDEX], before)
+
+    def test_cache_hit_skips_feed_query(self):
+        """ При попадании в кеш лента не читается из базы """
+        self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('index'))
+
+
+class TestConditionalGet(TestCase):
+    """ Тесты ответов 304 Not Modified по версиям лент """
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(
+            username="author", email="author@emeil.com", password="12345"
+        )
+        self.reader = User.objects.create_user(
+            username="reader", email="reader@emeil.com", password="54321"
+        )
+        self.post = Post.objects.create(text="Пост", author=self.author)
+        self.post_url = reverse('post', kwargs={
+            'username': self.author.username, 'post_id': self.post.pk
+        })
+
+    def revalidate(self, url, response, client=None):
+        return (client or self.client).get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+
+    def test_not_modified_without_queries(self):
+        """ Неизменная лента отдаётся как 304 без запросов к базе """
+        url = reverse('index')
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        with committed():
+            Post.objects.create(text="Новый пост", author=self.author)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_post_page_changes(self):
+        """ Страница поста меняется с комментарием и подпиской на автора """
+        response = self.client.get(self.post_url)
+        self.assertEqual(
+            self.revalidate(self.post_url, response).status_code, 304
+        )
+
+        with committed():
+            Comment.objects.create(post=self.post, author=self.reader,
+                                   text="Комментарий")
+        response = self.revalidate(self.post_url, response)
+        self.assertEqual(response.status_code, 200)
+
+        with committed():
+            Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(
+            self.revalidate(self.post_url, response).status_code, 200
+        )
+
+    def test_etag_depends_on_user(self):
+        """ ETag анонимной страницы не подходит авторизованному
+        пользователю, и ему не отдаётся Last-Modified """
+        response = self.client.get(self.post_url)
+        reader = Client()
+        reader.force_login(self.reader)
+
+        response = self.revalidate(self.post_url, response, reader)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_missing_page(self):
+        """ Для несуществующей страницы по-прежнему 404 """
+        url = reverse('group_posts', kwargs={'slug': 'missing'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class TestSharedCacheCheck(SimpleTestCase):
+    """ Проверка, что кеши лент общие для процессов """
+    def test_process_local_caches_reported(self):
+        warnings = checks.check_shared_caches(None)
+        self.assertEqual({warning.id for warning in warnings},
+                         {'posts.W001'})
+
+        # Файлы кеша при проверке не создаются
+        directory = tempfile.gettempdir()
+        file_cache = 'django.core.cache.backends.filebased.FileBasedCache'
+        with override_settings(CACHES={
+            alias: {'BACKEND': file_cache,
+                    'LOCATION': os.path.join(directory, alias)}
+            for alias in ('default', 'feed_versions')
+        }):
+            self.assertEqual(checks.check_shared_caches(None), [])
+
+class TestPageCache(TestCase):
+    """ Тесты кеша страниц для анонимных посетителей """
+    def setUp(self):
+        for page_cache in caches.all():
+            page_cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(
+            username="author", email="author@emeil.com", password="12345"
+        )
+        self.post = Post.objects.create(text="Пост", author=self.author)
+        self.post_url = reverse('post', kwargs={
+            'username': self.author.username, 'post_id': self.post.pk
+        })
+
+    def test_hit_without_queries(self):
+        """ Повторный запрос страницы обслуживается без базы и шаблонов,
+        в том числе условный """
+        first = self.client.get(self.post_url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.post_url)
+            not_modified = self.client.get(
+                self.post_url, HTTP_IF_NONE_MATCH=first['ETag']
+            )
+        self.assertIsNone(response.context)
+        self.assertEqual(response.content, first.content)
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_changes_purge_pages(self):
+        """ Новый пост и комментарий сбрасывают только свои страницы """
+        other = User.objects.create_user(
+            username="other", email="other@emeil.com", password="12345"
+        )
+        other_url = reverse('profile', kwargs={'username': other.username})
+        for url in (reverse('index'), self.post_url, other_url):
+            self.client.get(url)
+
+        with committed():
+            Post.objects.create(text="Новый пост", author=self.author)
+            Comment.objects.create(post=self.post, author=self.author,
+                                   text="Новый комментарий")
+
+        self.assertContains(self.client.get(reverse('index')), "Новый пост")
+        self.assertContains(self.client.get(self.post_url),
+                            "Новый комментарий")
+        self.assertIsNone(self.client.get(other_url).context)
+
+    def test_logged_in_not_cached(self):
+        """ Авторизованный пользователь получает свою страницу """
+        self.client.get(self.post_url)
+        self.client.force_login(self.author)
+
+        response = self.client.get(self.post_url)
+
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, "Редактировать")
+
+
+class TestApi(TestCase):
+    """ Тесты JSON API лент """
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(
+            username="author", email="author@emeil.com", password="12345"
+        )
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.posts = [
+            Post.objects.create(text=f"Пост {i}", author=self.author,
+                                group=self.group)
+            for i in range(15)
+        ]
+
+    def get_json(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_feed_pages(self):
+        """ Лента отдаётся страницами по курсору """
+        url = reverse('api_group_posts', kwargs={'slug': self.group.slug})
+        first = self.get_json(url, limit=10)
+        second = self.get_json(url, limit=10, cursor=first['next'])
+
+        ids = [post['id'] for post in first['results'] + second['results']]
+        self.assertEqual(ids, [post.pk for post in reversed(self.posts)])
+        self.assertIsNone(first['previous'])
+        self.assertIsNone(second['next'])
+        self.assertEqual(first['results'][0]['author'], 'author')
+        self.assertEqual(first['results'][0]['group'], 'group')
+
+    def test_sparse_fields(self):
+        """ Загружаются только колонки запрошенных полей """
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get_json(reverse('api_index'), fields='id,author')
+
+        self.assertEqual(set(data['results'][0]), {'id', 'author'})
+        self.assertNotIn('"text"', queries[-1]['sql'])
+        response = self.client.get(reverse('api_index'), {'fields': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_with_comments(self):
+        """ Пост отдаётся вместе с комментариями """
+        post = self.posts[0]
+        Comment.objects.create(post=post, author=self.author, text="Ответ")
+
+        data = self.get_json(reverse('api_post',
+                                     kwargs={'post_id': post.pk}))
+
+        self.assertEqual(data['post']['text'], post.text)
+        self.assertEqual([comment['text'] for comment in data['comments']],
+                         ["Ответ"])
+
+    def test_follow_requires_login(self):
+        response = self.client.get(reverse('api_follow_index'))
+        self.assertEqual(response.status_code, 403)
+
+
+class TestSyndication(TestCase):
+    """ Тесты лент RSS и Atom """
+    def setUp(self):
+        for feed_cache in caches.all():
+            feed_cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(
+            username="author", email="author@emeil.com", password="12345"
+        )
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.post = Post.objects.create(text="Первый пост", author=self.author,
+                                        group=self.group)
+        self.urls = [
+            reverse('group_rss', kwargs={'slug': self.group.slug}),
+            reverse('group_atom', kwargs={'slug': self.group.slug}),
+            reverse('author_rss', kwargs={'username': 'author'}),
+            reverse('author_atom', kwargs={'username': 'author'}),
+        ]
+
+    def test_feeds_cached_until_post_changes(self):
+        """ Лента собирается заново только после изменения постов """
+        # Анонимным клиентам ленту отдаст ещё и кеш страниц
+        self.client.force_login(self.author)
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertContains(response, "Первый пост")
+            with self.assertNumQueries(1):
+                self.client.get(url)
+
+        self.post.text = "Исправленный пост"
+        with committed():
+            self.post.save()
+
+        for url in self.urls:
+            self.assertContains(self.client.get(url), "Исправленный пост")
+
+    def test_not_modified(self):
+        """ Опрос неизменной ленты получает 304 для любого клиента """
+        url = self.urls[0]
+        response = self.client.get(url)
+        self.client.force_login(self.author)
+
+        repeated = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(repeated.status_code, 304)
+
+        with committed():
+            Post.objects.create(text="Второй пост", author=self.author,
+                                group=self.group)
+        repeated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeated.status_code, 200)
+
+
+class TestMetrics(TestCase):
+    """ Тесты страницы метрик """
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(User.objects.create_user(
+            username="reader", email="reader@emeil.com", password="12345"
+        ))
+        metrics.registry.clear()
+
+    def metric(self, text, line_start):
+        for line in text.splitlines():
+            if line.startswith(line_start):
+                return float(line.rsplit(' ', 1)[1])
+        return None
+
+    def test_requests_queries_and_cache(self):
+        """ Учитываются запросы, их длительность, запросы к базе
+        и попадания в кеш фрагментов """
+        cache.clear()
+        for _ in range(2):
+            self.client.get(reverse('index'))
+
+        text = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertEqual(self.metric(
+            text, 'yatube_requests_total{method="GET",status="200",'
+                  'view="index"}'), 2)
+        self.assertEqual(self.metric(
+            text, 'yatube_request_duration_seconds_count{view="index"}'), 2)
+        self.assertGreater(self.metric(
+            text, 'yatube_db_queries_total{view="index"}'), 0)
+        self.assertGreaterEqual(self.metric(
+            text, 'yatube_cache_requests_total{cache="default",'
+                  'result="hit"}'), 1)
+
+    def test_processes_aggregated(self):
+        """ Метрики других процессов складываются с метриками текущего,
+        а файлы завершившихся переносятся в общий и учитываются один раз """
+        # PID больше pid_max Linux: такого процесса нет
+        finished = f'{2 ** 22 + 1}-0.json'
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_DIR=directory):
+                self.client.get(reverse('index'))
+                metrics.registry.flush(force=True)
+                os.rename(os.path.join(directory,
+                                       metrics.registry.filename()),
+                          os.path.join(directory, finished))
+
+                # Второй сбор не учитывает перенесённый файл повторно
+                for _ in range(2):
+                    text = self.client.get(
+                        reverse('metrics')
+                    ).content.decode()
+                    self.assertEqual(self.metric(
+                        text, 'yatube_requests_total{method="GET",'
+                              'status="200",view="index"}'), 2)
+                self.assertFalse(os.path.exists(
+                    os.path.join(directory, finished)
+                ))
+                self.assertTrue(os.path.exists(
+                    os.path.join(directory, metrics.AGGREGATE)
+                ))
+
+    def test_process_file_names_unique(self):
+        """ Процесс с PID завершившегося не перезапишет его файл """
+        self.assertNotEqual(metrics.Registry().filename(),
+                            metrics.registry.filename())
+
+    def test_get_many_counted(self):
+        """ get_many, которым читаются версии лент, тоже учитывается """
+        versions = caches['feed_versions']
+        versions.set('known', 1)
+        versions.get_many(['known', 'unknown'])
+
+        text = self.client.get(reverse('metrics')).content.decode()
+        for result in ('hit', 'miss'):
+            self.assertEqual(self.metric(
+                text, f'yatube_cache_requests_total{{cache="feed-versions",'
+                      f'result="{result}"}}'), 1)
+
+    def test_forbidden_for_other_addresses(self):
+        response = self.client.get(reverse('metrics'),
+                                   REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+
+class TestServerTiming(TestCase):
+    """ Тесты заголовка Server-Timing """
+    def setUp(self):
+        user = User.objects.create_user(
+            username="reader", email="reader@emeil.com", password="12345"
+        )
+        Post.objects.create(text="Пост", author=user)
+        self.user = user
+
+    def test_disabled_by_default(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('index'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(SERVER_TIMING=True)
+    def test_breakdown_and_log(self):
+        """ Заголовок содержит время по категориям, в журнал пишется
+        строка JSON с тем же разбором и числом запросов """
+        client = Client()
+        client.force_login(self.user)
+        with self.assertLogs('yatube.timing', 'INFO') as logs:
+            response = client.get(reverse('index'))
+
+        entries = dict(entry.strip().split(';dur=') for entry
+                       in response['Server-Timing'].split(','))
+        self.assertEqual(set(entries), {'db', 'template', 'thumbnail',
+                                        'cache', 'view'})
+        self.assertGreater(float(entries['db']), 0)
+        self.assertGreater(float(entries['template']), 0)
+        self.assertGreaterEqual(float(entries['view']),
+                                float(entries['template']))
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'index')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertIn('template_ms', record)
+
+
+class TestSlowQueries(TestCase):
+    """ Тесты журнала медленных запросов """
+    def setUp(self):
+        # Лента не должна браться из кеша фрагментов прошлых тестов
+        for fragment_cache in caches.all():
+            fragment_cache.clear()
+        user = User.objects.create_user(
+            username="reader", email="reader@emeil.com", password="12345"
+        )
+        group = Group.objects.create(title="Группа", slug="group")
+        Post.objects.create(text="Пост", author=user, group=group)
+        self.client.force_login(user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log = os.path.join(directory.name, 'slow.log')
+
+    def test_shape(self):
+        self.assertEqual(
+            slow_queries.shape('SELECT  *\n FROM t WHERE id IN (%s, %s)'),
+            slow_queries.shape('SELECT * FROM t WHERE id IN (%s)'),
+        )
+
+    def test_disabled_by_default(self):
+        self.client.get(reverse('group_posts', kwargs={'slug': 'group'}))
+        self.assertFalse(os.path.exists(self.log))
+
+    def test_log_and_report(self):
+        """ Медленные запросы записываются с представлением, строкой кода
+        и планом, а команда складывает одинаковые формы """
+        with override_settings(SLOW_QUERY_THRESHOLD=0,
+                               SLOW_QUERY_LOG=self.log):
+            client = Client()
+            client.force_login(User.objects.get(username="reader"))
+            with self.assertLogs('yatube.slow_queries', 'WARNING'):
+                for _ in range(2):
+                    client.get(reverse('group_posts',
+                                       kwargs={'slug': 'group'}))
+
+        records = list(slow_queries.read(self.log))
+        posts = [record for record in records
+                 if record['view'] == 'group_posts'
+                 and 'FROM "posts_post"' in record['shape']]
+        self.assertTrue(posts)
+        self.assertTrue(all(record['plan'] for record in posts))
+        self.assertTrue(any(record['origin'].startswith('posts/')
+                            for record in posts))
+
+        entries = slow_queries.aggregate(records)
+        self.assertEqual(len(entries), len({
+            record['fingerprint'] for record in records
+        }))
+        self.assertEqual(sum(entry['count'] for entry in entries),
+                         len(records))
+        # Поиск группы выполняется при каждом запросе страницы
+        self.assertGreaterEqual(max(entry['count'] for entry in entries), 2)
+
+        output = StringIO()
+        call_command('slow_queries', log=self.log, top=3, stdout=output)
+        self.assertIn(entries[0]['fingerprint'], output.getvalue())
+
+
+class TestSqliteBackend(SimpleTestCase):
+    """ Тесты бэкенда SQLite на файловой базе """
+    WRITERS = 4
+    READERS = 4
+    ITERATIONS = 50
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases['contention'] = {
+            'ENGINE': 'yatube.backends.sqlite3',
+            'NAME': os.path.join(directory.name, 'contention.sqlite3'),
+        }
+        connections.ensure_defaults('contention')
+        self.addCleanup(connections.databases.pop, 'contention')
+        self.addCleanup(connections.__delitem__, 'contention')
+        self.addCleanup(connections['contention'].close)
+        with connections['contention'].cursor() as cursor:
+            cursor.execute('CREATE TABLE counter (value INTEGER)')
+            cursor.execute('INSERT INTO counter VALUES (0)')
+
+    def test_pragmas(self):
+        with connections['contention'].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_concurrent_reads_and_writes(self):
+        """ Транзакции «прочитать, затем записать» из нескольких потоков
+        не падают с database is locked и не теряют обновления """
+        errors = []
+
+        def worker(write):
+            try:
+                for _ in range(self.ITERATIONS):
+                    with transaction.atomic(using='contention'):
+                        with connections['contention'].cursor() as cursor:
+                            cursor.execute('SELECT value FROM counter')
+                            value = cursor.fetchone()[0]
+                            if write:
+                                cursor.execute('UPDATE counter SET value = %s',
+                                               [value + 1])
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections['contention'].close()
+
+        threads = [
+            threading.Thread(target=worker, args=(index < self.WRITERS,))
+            for index in range(self.WRITERS + self.READERS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with connections['contention'].cursor() as cursor:
+            cursor.execute('SELECT value FROM counter')
+            self.assertEqual(cursor.fetchone()[0],
+                             self.WRITERS * self.ITERATIONS)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class TestReplicaRouter(SimpleTestCase):
+    """ Тесты выбора базы для чтения """
+    def read_alias(self, request):
+        @routers.replica_reads
+        def view(request):
+            return routers.ReplicaRouter().db_for_read(Post)
+        return view(request)
+
+    def test_reads(self):
+        factory = RequestFactory()
+        self.assertEqual(self.read_alias(factory.get('/')), 'replica')
+        self.assertEqual(self.read_alias(factory.post('/')), 'default')
+        sticky = factory.get('/')
+        sticky.COOKIES[routers.STICKY_COOKIE] = '1'
+        self.assertEqual(self.read_alias(sticky), 'default')
+        # Вне представлений с декоратором чтение идёт в основную базу
+        self.assertEqual(routers.ReplicaRouter().db_for_read(Post), 'default')
+
+    def test_writes_and_migrations(self):
+        router = routers.ReplicaRouter()
+        self.assertEqual(router.db_for_write(Post), 'default')
+        self.assertTrue(router.allow_migrate('default', 'posts'))
+        self.assertFalse(router.allow_migrate('replica', 'posts'))
+
+
+class TestReplicas(TestCase):
+    """ Тесты чтения своих записей """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="reader", email="reader@emeil.com", password="12345"
+        )
+        self.post = Post.objects.create(text="Пост", author=self.user)
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_sticky_cookie_after_write(self):
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(reverse('index'))
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+
+        response = client.post(reverse('add_comment', kwargs={
+            'username': 'reader', 'post_id': self.post.pk,
+        }), {'text': 'Комментарий'})
+        self.assertIn(routers.STICKY_COOKIE, response.cookies)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_cookie_without_replicas(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('add_comment', kwargs={
+            'username': 'reader', 'post_id': self.post.pk,
+        }), {'text': 'Комментарий'})
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+
+
+class TestSyncReplicas(TransactionTestCase):
+    """ Реплика получает данные основной базы. Копируются только
+    зафиксированные данные, поэтому тест без общей транзакции """
+    def test_sync(self):
+        Post.objects.create(text="Пост", author=User.objects.create_user(
+            username="reader", email="reader@emeil.com", password="12345"
+        ))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'replica.sqlite3')
+        connections.databases['replica'] = {
+            'ENGINE': 'yatube.backends.sqlite3', 'NAME': path,
+        }
+        self.addCleanup(connections.databases.pop, 'replica')
+        self.addCleanup(connections.__delitem__, 'replica')
+
+        with override_settings(DATABASE_REPLICAS=['replica']):
+            call_command('sync_replicas', stdout=StringIO())
+
+        replica = sqlite3.connect(path)
+        self.addCleanup(replica.close)
+        self.assertEqual(replica.execute(
+            'SELECT text FROM posts_post'
+        ).fetchall(), [('Пост',)])
+
+
+class QueryBudgetMixin:
+    """ Проверка, что страница укладывается в бюджет запросов к базе """
+    def assertQueryBudget(self, budget, client, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+            if response.streaming:
+                # Потоковый ответ читает базу при выдаче содержимого
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, url)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{url}: {len(queries)} запросов при бюджете {budget}:\n'
+            + '\n'.join(query['sql'] for query in queries)
+        )
+        return len(queries)
+
+
+class PostPagesMixin:
+    """ Автор, читатель, группа и пост; адреса всех страниц posts/urls.py """
+    QUERY_STRINGS = {'search': 'q=Пост'}
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(
+            username="author", email="author@emeil.com", password="12345"
+        )
+        self.reader = User.objects.create_user(
+            username="reader", email="reader@emeil.com", password="54321"
+        )
+        self.group = Group.objects.create(title='test_group',
+                                          slug='test_group')
+        self.post = self.add_posts(1)[0]
+
+    def add_posts(self, count):
+        posts = []
+        for i in range(count):
+            post = Post.objects.create(text=f"Пост {i}", author=self.author,
+                                       group=self.group)
+            Comment.objects.create(post=post, author=self.reader,
+                                   text="Комментарий")
+            posts.append(post)
+        return posts
+
+    def urls(self):
+        kwargs = {
+            'slug': self.group.slug,
+            'username': self.author.username,
+            'post_id': self.post.pk,
+        }
+        for pattern in urls.urlpatterns:
+            names = pattern.pattern.converters
+            url = reverse(pattern.name,
+                          kwargs={name: kwargs[name] for name in names})
+            if pattern.name in self.QUERY_STRINGS:
+                url = f'{url}?{self.QUERY_STRINGS[pattern.name]}'
+            yield pattern.name, url
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+})
+class TestQueryBudget(PostPagesMixin, QueryBudgetMixin, TestCase):
+    """ Число запросов страниц posts/urls.py не зависит от размера страницы """
+    # Сессия и пользователь — 2 запроса у любой страницы
+    # для авторизованного пользователя
+    BUDGETS = {
+        'index': 3,
+        'group_posts': 5,
+        'new_post': 3,
+        'follow_index': 4,
+        'profile': 6,
+        'post': 6,
+        'post_comments': 5,
+        'post_edit': 5,
+        'add_comment': 3,
+        'profile_follow': 16,
+        'profile_unfollow': 9,
+        'search': 4,
+        'api_index': 3,
+        'api_post': 4,
+        'api_group_posts': 4,
+        'api_profile': 4,
+        'api_follow_index': 4,
+        'group_rss': 4,
+        'group_atom': 4,
+        'author_rss': 4,
+        'author_atom': 4,
+    }
+
+    def measure(self):
+        counts = {}
+        # Ленты RSS читают текущий сайт, который кешируется в процессе
+        Site.objects.clear_cache()
+        for name, url in self.urls():
+            self.assertIn(name, self.BUDGETS,
+                          f'Задайте бюджет запросов для `{name}`')
+            self.client.force_login(self.author if name in (
+                'post_edit', 'new_post') else self.reader)
+            counts[name] = self.assertQueryBudget(self.BUDGETS[name],
+                                                  self.client, url)
+        return counts
+
+    def test_query_budget(self):
+        """ Каждая страница укладывается в бюджет запросов,
+        и он не растёт с числом постов и комментариев """
+        few = self.measure()
+        self.add_posts(25)
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.reader, text="Ещё")
+            for _ in range(10)
+        )
+        many = self.measure()
+        self.assertEqual(few, many)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+})
+class TestQueryPlans(PostPagesMixin, TestCase):
+    """ Запросы страниц posts/urls.py не читают таблицы целиком
+    и не сортируют строки во временном B-дереве """
+    # Полный просмотр таблицы (без индекса) или сортировка без индекса;
+    # SQLite до 3.36 пишет SCAN TABLE
+    BAD_STEP = re.compile(r'\bSCAN (TABLE )?\w+$|USE TEMP B-TREE')
+    # Строка плана: id, id родителя, не используется, описание шага
+    STEP = re.compile(r'^(\d+) (\d+) \d+ (.*)$')
+    TABLE = re.compile(r'\b(?:SCAN|SEARCH) (?:TABLE )?(\w+)')
+    # Страница и таблица, где это ожидаемо: формы поста выводят все
+    # группы, а поиск сортирует совпадения по релевантности
+    ALLOWED = {('new_post', 'posts_group'), ('post_edit', 'posts_group'),
+               ('search', 'posts_post_fts')}
+
+    def bad_plans(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, url)
+        for query in queries:
+            plan = slow_queries.explain(connection, query['sql'], None)
+            steps = [match.groups() for match in map(self.STEP.match,
+                                                     plan or ()) if match]
+            for _, parent, detail in steps:
+                if self.BAD_STEP.search(detail):
+                    yield query['sql'], self.step_table(detail, parent,
+                                                        steps), detail
+
+    def step_table(self, detail, parent, steps):
+        """ Таблица шага плана. У сортировки её нет: берётся первая
+        таблица того же уровня плана (запроса или подзапроса) """
+        match = self.TABLE.search(detail)
+        if match is None:
+            match = next(filter(None, (
+                self.TABLE.search(other) for _, other_parent, other in steps
+                if other_parent == parent
+            )), None)
+        return match and match.group(1)
+
+    def test_no_full_scans(self):
+        self.add_posts(30)
+        Site.objects.clear_cache()
+        failures = []
+        for name, url in self.urls():
+            self.client.force_login(self.author if name in (
+                'post_edit', 'new_post') else self.reader)
+            for sql, table, step in self.bad_plans(url):
+                if (name, table) in self.ALLOWED:
+                    continue
+                failures.append(f'{name}: {sql}\n    {step}')
+        self.assertEqual(failures, [], '\n'.join(failures))
+
+
+@skipUnless(importlib.util.find_spec('jinja2'), 'Jinja2 не установлен')
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+})
+class TestJinja2Templates(PostPagesMixin, TestCase):
+    """ Шаблоны из templates/jinja2 дают тот же HTML, что и шаблоны Django """
+    PAGES = ('index', 'group_posts', 'profile', 'post', 'post_comments',
+             'follow_index')
+    TEMPLATES = frozenset({'index.html', 'group.html', 'profile.html',
+                           'post.html', 'follow.html',
+                           'includes/comment_list.html'})
+    # Токен CSRF в форме комментария свой при каждом рендеринге
+    CSRF_TOKEN = re.compile(r'(name="csrfmiddlewaretoken" value=)"[^"]+"')
+
+    def setUp(self):
+        super().setUp()
+        self.post.text = ('<b>Жирный</b> "текст" с \'кавычками\'\n& ' * 40)
+        self.post.save()
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.add_posts(12)
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.reader, text="<i>Ещё</i>")
+            for _ in range(25)
+        )
+
+    def render(self, url, templates):
+        with self.settings(JINJA2_TEMPLATES=templates):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        # Тестовый клиент видит контекст только у шаблонов Django
+        self.assertEqual(response.context is None, bool(templates), url)
+        return self.CSRF_TOKEN.sub(r'\1""', response.content.decode())
+
+    def test_same_output(self):
+        """ Первые и вторые страницы лент и комментариев совпадают
+        у гостя, читателя и автора постов """
+        for user in (self.reader, self.author, None):
+            if user is None:
+                self.client.logout()
+            else:
+                self.client.force_login(user)
+            for name, url in self.urls():
+                # Подписан на автора только читатель
+                if name not in self.PAGES or (name == 'follow_index'
+                                              and user != self.reader):
+                    continue
+                for page in (url, f'{url}?cursor={self.next_cursor(url)}'):
+                    with self.subTest(user=user, url=page):
+                        self.assertEqual(self.render(page, self.TEMPLATES),
+                                         self.render(page, frozenset()))
+
+    def next_cursor(self, url):
+        """ Курсор следующей страницы ленты или комментариев """
+        response = self.client.get(url)
+        match = re.search(r'cursor=([\w-]+)', response.content.decode())
+        self.assertIsNotNone(match, url)
+        return match.group(1)
+
+    def test_selected_per_template(self):
+        """ Jinja2 рендерит только шаблоны из JINJA2_TEMPLATES """
+        with self.settings(JINJA2_TEMPLATES=frozenset({'index.html'})):
+            index = self.client.get(reverse('index'))
+            group = self.client.get(reverse('group_posts',
+                                            args=[self.group.slug]))
+        self.assertIsNone(index.context)
+        self.assertTemplateUsed(group, 'group.html')
+
+
+class TestSearch(TestCase):
+    """ Тесты полнотекстового поиска """
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="test_user", email="test_user@emeil.com", password="12345"
+        )
+        self.group = Group.objects.create(title='Котики', slug='cats')
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('search'), {'q': query, **params})
+        return response, [post.pk for post in response.context['page']]
+
+    def test_ranked_results_with_snippets(self):
+        """ Посты находятся по словоформам, более релевантные выше,
+        а совпадения выделены в экранированном фрагменте """
+        once = Post.objects.create(text="Кот <b>спит</b> весь день",
+                                   author=self.user)
+        twice = Post.objects.create(text="Коты и снова коты",
+                                    author=self.user)
+        Post.objects.create(text="Про собак", author=self.user)
+
+        response, found = self.search('кот')
+
+        self.assertEqual(found, [twice.pk, once.pk])
+        self.assertContains(response, '<mark>Кот</mark> &lt;b&gt;спит')
+
+    def test_index_follows_changes(self):
+        """ Индекс обновляется при изменении, удалении поста
+        и переименовании группы """
+        post = Post.objects.create(text="Первая версия", author=self.user,
+                                   group=self.group)
+        self.assertEqual(self.search('котики')[1], [post.pk])
+
+        post.text = "Вторая версия"
+        post.save()
+        self.assertEqual(self.search('первая')[1], [])
+        self.assertEqual(self.search('вторая')[1], [post.pk])
+
+        self.group.title = 'Собаки'
+        self.group.save()
+        self.assertEqual(self.search('котики')[1], [])
+        self.assertEqual(self.search('собаки')[1], [post.pk])
+
+        post.delete()
+        self.assertEqual(self.search('вторая')[1], [])
+
+    def test_pages(self):
+        """ Результаты делятся на страницы без повторов и пропусков """
+        posts = [Post.objects.create(text=f"Поиск номер {i}",
+                                     author=self.user) for i in range(25)]
+
+        found, cursor = [], None
+        while True:
+            response, ids = self.search('поиск', **(
+                {'cursor': cursor} if cursor else {}))
+            found += ids
+            cursor = response.context['page'].next_cursor
+            if cursor is None:
+                break
+        self.assertCountEqual(found, [post.pk for post in posts])
+
+        response, ids = self.search(
+            'поиск', cursor=response.context['page'].previous_cursor)
+        self.assertEqual(ids, found[-15:-5])
+
+    def test_admin_search(self):
+        """ Поиск в админке использует тот же индекс """
+        post = Post.objects.create(text="Котики в админке",
+                                   author=self.user)
+        Post.objects.create(text="Собаки", author=self.user)
+        admin = User.objects.create_superuser(
+            username="admin", email="admin@emeil.com", password="12345"
+        )
+        self.client.force_login(admin)
+
+        response = self.client.get(reverse('admin:posts_post_changelist'),
+                                   {'q': 'котик'})
+
+        self.assertEqual(list(response.context['cl'].result_list), [post])
+
+    def test_query_syntax_is_ignored(self):
+        """ Спецсимволы FTS5 в запросе не приводят к ошибке """
+        post = Post.objects.create(text="Кавычки и звёздочки",
+                                   author=self.user)
+        self.assertEqual(self.search('"кавычки* (')[1], [post.pk])
+        self.assertEqual(self.search('*** ')[1], [])
+
+
+def make_image(name='image.jpg', size=(1200, 800), color=(200, 30, 30),
+               fmt='JPEG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue(),
+                              content_type=f'image/{fmt.lower()}')
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+})
+class TestThumbnails(TestCase):
+    """ Тесты миниатюр изображений постов """
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.user = User.objects.create_user(
+            username="test_user", email="test_user@emeil.com", password="12345"
+        )
+        self.post = Post.objects.create(text="Пост с картинкой",
+                                        author=self.user, image=make_image())
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def test_original_until_variants_exist(self):
+        """ Пока миниатюр нет, выводится исходное изображение,
+        а после их создания — srcset со всеми ширинами """
+        response = Client().get(reverse('index'))
+        self.assertContains(response, f'src="{self.post.image.url}"')
+        self.assertNotContains(response, 'srcset')
+
+        thumbnails.generate_variants(self.post.image.name)
+
+        response = Client().get(reverse('index'))
+        self.assertNotContains(response, f'src="{self.post.image.url}"')
+        for width in (480, 960, 1440):
+            self.assertContains(response, f' {width}w')
+
+    @override_settings(THUMBNAIL_WORKERS=0, CACHES=settings.CACHES)
+    def test_cached_feed_updated_after_variants(self):
+        """ Готовые миниатюры видны и в закешированной ленте """
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        response = Client().get(reverse('index'))
+        self.assertNotContains(response, 'srcset')
+
+        with committed():
+            thumbnails.schedule(self.post)
+
+        response = Client().get(reverse('index'))
+        self.assertContains(response, 'srcset')
+
+
+class TestImageUpload(TestCase):
+    """ Тесты обработки загруженных изображений """
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.user = User.objects.create_user(
+            username="test_user", email="test_user@emeil.com", password="12345"
+        )
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    @override_settings(POST_IMAGE_MAX_SIDE=300)
+    def test_image_is_reencoded(self):
+        """ Снимок поворачивается по EXIF, уменьшается
+        и сохраняется в JPEG без метаданных """
+        buffer = BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: повернуть на 90°
+        exif[0x010f] = 'Camera'
+        Image.new('RGB', (1200, 800)).save(buffer, 'JPEG', exif=exif,
+                                            quality=100)
+        upload = SimpleUploadedFile('photo.jpeg', buffer.getvalue(),
+                                    content_type='image/jpeg')
+
+        self.client.post(reverse('new_post'),
+                         {'text': 'Фото', 'image': upload})
+
+        post = Post.objects.get(text='Фото')
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        stored = Image.open(post.image.path)
+        self.assertEqual(stored.size, (200, 300))
+        self.assertFalse(stored.getexif())
+        self.assertLess(post.image.size, len(buffer.getvalue()))
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=1024)
+    def test_large_upload_rejected(self):
+        """ Слишком большой файл отклоняется с ошибкой формы """
+        response = self.client.post(reverse('new_post'),
+                                    {'text': 'Большое фото',
+                                     'image': make_image(size=(600, 600))})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('image', response.context['form'].errors)
+        self.assertFalse(Post.objects.filter(text='Большое фото').exists())
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100)
+    def test_too_many_pixels(self):
+        """ Изображение с большим числом пикселей не принимается """
+        response = self.client.post(reverse('new_post'),
+                                    {'text': 'Много пикселей',
+                                     'image': make_image(size=(20, 20))})
+        self.assertIn('image', response.context['form'].errors)
+
+
+class TestContentAddressedStorage(TransactionTestCase):
+    """ Тесты хранения изображений по хешу содержимого.
+
+    TransactionTestCase: файлы освобождаются в `on_commit`.
+    """
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.user = User.objects.create_user(
+            username="test_user", email="test_user@emeil.com", password="12345"
+        )
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def test_same_image_stored_once(self):
+        """ Одинаковые изображения хранятся одним файлом, который
+        удаляется вместе с последним ссылающимся на него постом """
+        first = Post.objects.create(text="Первый", author=self.user,
+                                    image=make_image('first.jpg'))
+        second = Post.objects.create(text="Второй", author=self.user,
+                                     image=make_image('second.jpg'))
+        self.assertEqual(first.image.name, second.image.name)
+        path = first.image.path
+
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_replaced_image_released(self):
+        """ При замене изображения старый файл удаляется """
+        post = Post.objects.create(text="Пост", author=self.user,
+                                   image=make_image('old.jpg'))
+        old_path = post.image.path
+
+        post.image = make_image('new.jpg', color=(30, 200, 30))
+        post.save()
+
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(post.image.path))
+
+    def test_references_counted(self):
+        """ Ссылки постов на файл считаются в его строке StoredFile """
+        first = Post.objects.create(text="Первый", author=self.user,
+                                    image=make_image('first.jpg'))
+        Post.objects.create(text="Второй", author=self.user,
+                            image=make_image('second.jpg'))
+        stored = StoredFile.objects.get(name=first.image.name)
+        self.assertEqual(stored.references, 2)
+
+        first.delete()
+        stored.refresh_from_db()
+        self.assertEqual(stored.references, 1)
+
+    def test_file_saved_again_before_release_kept(self):
+        """ Файл, который снова сохранили до удаления последней ссылки,
+        не удаляется: удаление проверяет счётчик после фиксации """
+        post = Post.objects.create(text="Пост", author=self.user,
+                                   image=make_image('first.jpg'))
+        path = post.image.path
+        with transaction.atomic():
+            post.delete()
+            again = Post.objects.create(text="Снова", author=self.user,
+                                        image=make_image('second.jpg'))
+        self.assertEqual(again.image.path, path)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(
+            StoredFile.objects.get(name=again.image.name).references, 1
+        )
@@ -0,0 +1,96 @@
+""" Миниатюры изображений постов.
+
+Миниатюры нескольких ширин (для `srcset`) создаются пулом потоков
+(posts/workers.py) после сохранения поста, а не при первом показе
+страницы. Шаблон выводит только уже готовые миниатюры, а пока их нет —
+исходное изображение; когда миниатюры готовы, версии лент поста
+обновляются, и закешированные фрагменты с исходным изображением
+перестают использоваться.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from posts import signals, workers
+from posts.models import Post
+from yatube import timing
+
+logger = logging.getLogger(__name__)
+
+# Пропорции карточки поста (960x339) и параметры обрезки
+ASPECT_RATIO = 339 / 960
+OPTIONS = {'crop': 'center', 'upscale': True}
+
+class PostThumbnailBackend(ThumbnailBackend):
+    def get_cached_thumbnail(self, file_, geometry_string, **options):
+        """ Готовая миниатюра из хранилища sorl или None, без генерации """
+        source = ImageFile(file_)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+
+backend = PostThumbnailBackend()
+
+
+def geometry(width):
+    return f'{width}x{round(width * ASPECT_RATIO)}'
+
+
+def source(image_name):
+    # Хранилище входит в ключ миниатюры sorl, поэтому исходный файл
+    # всегда открывается через хранилище поля, как и `post.image`
+    return ImageFile(image_name, Post._meta.get_field('image').storage)
+
+
+def generate_variants(image_name):
+    """ Создать миниатюры изображения всех ширин POST_IMAGE_WIDTHS """
+    for width in settings.POST_IMAGE_WIDTHS:
+        backend.get_thumbnail(source(image_name), geometry(width), **OPTIONS)
+
+
+def cached_variants(image):
+    """ Готовые миниатюры изображения: список пар (ширина, миниатюра) """
+    variants = []
+    with timing.track('thumbnail'):
+        for width in settings.POST_IMAGE_WIDTHS:
+            thumbnail = backend.get_cached_thumbnail(image, geometry(width),
+                                                     **OPTIONS)
+            if thumbnail is not None:
+                variants.append((width, thumbnail))
+    return variants
+
+
+def _generate_safely(post_id, image_name):
+    # Ошибка миниатюр не должна ломать публикацию поста:
+    # шаблон покажет исходное изображение
+    try:
+        with timing.track('thumbnail'):
+            generate_variants(image_name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', image_name)
+        return
+    signals.bump_post_feeds(post_id)
+
+
+def schedule(post):
+    """ Поставить в очередь создание миниатюр после фиксации транзакции """
+    if post.image:
+        post_id, image_name = post.pk, post.image.name
+        transaction.on_commit(lambda: workers.submit(
+            'thumbnail', _generate_safely, post_id, image_name
+        ))
@@ -0,0 +1,215 @@
+""" Материализованная лента подписок (fan-out on write).
+
+При публикации пост раскладывается в ленты подписчиков автора, поэтому
+чтение ленты — это один диапазон по индексу (user, -pub_date) таблицы
+`TimelineEntry`. Посты авторов, у которых подписчиков больше
+FOLLOW_FANOUT_LIMIT, не раскладываются: такие авторы подмешиваются
+в ленту при чтении через join по подпискам.
+
+Раскладывать ли посты автора, хранит флаг `AuthorStats.fanout`.
+Он выключается, как только подписчиков становится больше предела,
+а включается снова, лишь когда их на FOLLOW_FANOUT_HYSTERESIS меньше:
+тогда пул потоков (posts/workers.py) раскладывает последние посты
+автора по лентам подписчиков — это не делается в запросе отписки.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+
+from posts import workers
+from posts.models import AuthorStats, Follow, Post, TimelineEntry
+
+BATCH_SIZE = 500
+# Порядок ленты, возвращаемой follow_feed()
+FEED_ORDERING = ('-feed_date', '-feed_id')
+
+
+def is_fanout_author(author_id):
+    """ Раскладывать ли посты автора по лентам подписчиков """
+    fanout = AuthorStats.objects.filter(user_id=author_id).values_list(
+        'fanout', flat=True
+    ).first()
+    return fanout is not False
+
+
+def stop_fanout(author_id):
+    """ Перестать раскладывать посты автора, у которого подписчиков
+    стало больше FOLLOW_FANOUT_LIMIT """
+    AuthorStats.objects.filter(
+        user_id=author_id, fanout=True,
+        followers_count__gt=settings.FOLLOW_FANOUT_LIMIT,
+    ).update(fanout=False)
+
+
+def _light_again(author_id):
+    """ Автор, раскладку постов которого пора включить снова """
+    return AuthorStats.objects.filter(
+        user_id=author_id, fanout=False,
+        followers_count__lte=(settings.FOLLOW_FANOUT_LIMIT
+                              - settings.FOLLOW_FANOUT_HYSTERESIS),
+    )
+
+
+def schedule_resume_fanout(author_id):
+    """ После фиксации отписки включить раскладку в пуле потоков,
+    если подписчиков стало достаточно мало """
+    if _light_again(author_id).exists():
+        transaction.on_commit(
+            lambda: workers.submit('timeline', resume_fanout, author_id)
+        )
+
+
+def fan_out(post):
+    """ Добавить новый пост в ленты подписчиков автора """
+    if not is_fanout_author(post.author_id):
+        return
+
+    followers = Follow.objects.filter(author_id=post.author_id).values_list(
+        'user_id', flat=True
+    )
+    batch = []
+    for user_id in followers.iterator():
+        batch.append(user_id)
+        if len(batch) == BATCH_SIZE:
+            _fan_out_batch(post, batch)
+            batch = []
+    if batch:
+        _fan_out_batch(post, batch)
+
+
+def _fan_out_batch(post, user_ids):
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post.pk,
+                       author_id=post.author_id, pub_date=post.pub_date)
+         for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+    # Обрезаем ленты с запасом, чтобы не чистить их после каждого поста
+    length = settings.FOLLOW_TIMELINE_LENGTH
+    overgrown = TimelineEntry.objects.filter(user_id__in=user_ids).values(
+        'user_id'
+    ).annotate(total=Count('pk')).filter(total__gt=length + length // 10)
+    for user_id in overgrown.values_list('user_id', flat=True):
+        trim(user_id)
+
+
+def _recent_posts(author_id, after_pk=None):
+    posts = Post.objects.filter(author_id=author_id)
+    if after_pk is not None:
+        posts = posts.filter(pk__gt=after_pk)
+    return posts.order_by('-pub_date', '-id').values_list(
+        'pk', 'pub_date'
+    )[:settings.FOLLOW_TIMELINE_LENGTH]
+
+
+def backfill(user_id, author_id):
+    """ Добавить в ленту пользователя последние посты нового автора """
+    if not is_fanout_author(author_id):
+        return
+
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post_id,
+                       author_id=author_id, pub_date=pub_date)
+         for post_id, pub_date in _recent_posts(author_id)],
+        ignore_conflicts=True,
+    )
+    trim(user_id)
+
+
+def resume_fanout(author_id):
+    """ Снова раскладывать посты автора и разложить уже опубликованные.
+
+    Пока флаг не включён, автор подмешивается в ленты при чтении,
+    поэтому сначала посты раскладываются, а потом включается флаг.
+    Посты, опубликованные за это время, раскладываются следом.
+    """
+    if not _light_again(author_id).exists():
+        return
+    last_pk = Post.objects.filter(author_id=author_id).aggregate(
+        last=Max('pk')
+    )['last']
+    backfill_followers(author_id)
+    with transaction.atomic():
+        if _light_again(author_id).update(fanout=True):
+            backfill_followers(author_id, after_pk=last_pk or 0)
+
+
+def backfill_followers(author_id, after_pk=None):
+    """ Разложить последние посты автора (с id больше `after_pk`)
+    по лентам всех подписчиков """
+    posts = list(_recent_posts(author_id, after_pk))
+    if not posts:
+        return
+    followers = Follow.objects.filter(author_id=author_id).values_list(
+        'user_id', flat=True
+    )
+    for user_id in followers.iterator():
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=post_id,
+                           author_id=author_id, pub_date=pub_date)
+             for post_id, pub_date in posts],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        trim(user_id)
+
+
+def refill(user_id):
+    """ Заполнить ленту пользователя последними постами всех его авторов.
+
+    Нужно после загрузки данных в обход сигналов (команда import_jsonl).
+    """
+    posts = Post.objects.filter(
+        author__following__user_id=user_id,
+        author__stats__fanout=True,
+    ).order_by('-pub_date', '-id').values_list(
+        'pk', 'author_id', 'pub_date'
+    )[:settings.FOLLOW_TIMELINE_LENGTH]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post_id,
+                       author_id=author_id, pub_date=pub_date)
+         for post_id, author_id, pub_date in posts],
+        ignore_conflicts=True,
+    )
+    trim(user_id)
+
+
+def remove(user_id, author_id):
+    """ Убрать из ленты пользователя посты автора после отписки """
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 author_id=author_id).delete()
+
+
+def trim(user_id):
+    """ Оставить в ленте пользователя FOLLOW_TIMELINE_LENGTH записей """
+    length = settings.FOLLOW_TIMELINE_LENGTH
+    entries = TimelineEntry.objects.filter(user_id=user_id)
+    last_kept = entries.order_by('-pub_date', '-post_id').values_list(
+        'pub_date', 'post_id'
+    )[length - 1:length]
+    if last_kept:
+        pub_date, post_id = last_kept[0]
+        entries.filter(pub_date__lte=pub_date).exclude(
+            pub_date=pub_date, post_id__gte=post_id
+        ).delete()
+
+
+def follow_feed(user):
+    """ Посты авторов, на которых подписан пользователь.
+
+    Лента упорядочена по полям `feed_date` и `feed_id`, которые нужно
+    передать в `CursorPaginator` как порядок сортировки.
+    """
+    heavy_authors = Follow.objects.filter(
+        user=user, author__stats__fanout=False,
+    ).values('author')
+    if not heavy_authors.exists():
+        return Post.objects.filter(timeline_entries__user=user).annotate(
+            feed_date=F('timeline_entries__pub_date'),
+            feed_id=F('timeline_entries__post_id'),
+        )
+
+    timeline = TimelineEntry.objects.filter(user=user).values('post')
+    return Post.objects.filter(
+        Q(pk__in=timeline) | Q(author__in=heavy_authors)
+    ).annotate(feed_date=F('pub_date'), feed_id=F('pk'))
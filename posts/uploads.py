@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+
+class UploadSizeLimitHandler(FileUploadHandler):
+    """ Прекращает приём файла, как только он превысил UPLOAD_MAX_FILE_SIZE.
+
+    Стоит первым в FILE_UPLOAD_HANDLERS и передаёт данные следующим
+    обработчикам, поэтому слишком большой файл не дочитывается в память
+    или во временный файл. Имена отклонённых полей сохраняются
+    в `request.rejected_uploads`.
+    """
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.UPLOAD_MAX_FILE_SIZE:
+            if not hasattr(self.request, 'rejected_uploads'):
+                self.request.rejected_uploads = set()
+            self.request.rejected_uploads.add(self.field_name)
+            raise SkipFile
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
@@ -1,20 +1,37 @@
 from django.urls import path
 
-from posts import views
+from posts import api, feeds, views
 
 urlpatterns = [
     path("", views.index, name="index"),
     # Страниц группы постов
     path("group/<slug:slug>/", views.group_posts, name='group_posts'),
+    # Ленты RSS и Atom группы
+    path("group/<slug:slug>/rss/", feeds.group_rss, name='group_rss'),
+    path("group/<slug:slug>/atom/", feeds.group_atom, name='group_atom'),
     # Создание нового поста
     path("new/", views.new_post, name='new_post'),
     # Страница с постами авторов,
     # на которые подписан авторизованный пользователь
     path("follow/", views.follow_index, name="follow_index"),
+    # Поиск по постам
+    path("search/", views.search, name="search"),
+    # JSON API лент
+    path("api/posts/", api.index, name="api_index"),
+    path("api/posts/<int:post_id>/", api.post_view, name="api_post"),
+    path("api/group/<slug:slug>/", api.group_posts, name="api_group_posts"),
+    path("api/users/<str:username>/", api.profile, name="api_profile"),
+    path("api/follow/", api.follow_index, name="api_follow_index"),
     # Профайл пользователя
     path('<str:username>/', views.profile, name='profile'),
+    # Ленты RSS и Atom автора
+    path('<str:username>/rss/', feeds.author_rss, name='author_rss'),
+    path('<str:username>/atom/', feeds.author_atom, name='author_atom'),
     # Просмотр записи
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
+    # Следующая порция комментариев поста
+    path('<str:username>/<int:post_id>/comments/',
+         views.post_comments, name='post_comments'),
     # Редактирование поста
     path(
         '<str:username>/<int:post_id>/edit/',
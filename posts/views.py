@@ -1,48 +1,88 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 
+from posts import queries, thumbnails, timeline
+from posts.cache import (INDEX, author_scope, conditional, fragment_context,
+                         group_scope, post_scope)
 from posts.forms import CommentForm, PostForm
-from posts.models import Follow, Group, Post, User
+from posts.models import AuthorStats, Follow, Group, Post, User
+from posts.paginator import CursorPaginator
+from posts.search import SearchPaginator
+from yatube.routers import replica_reads
 
 
+def author_id(username):
+    return User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ).first()
+
+
+def index_scopes():
+    return [INDEX]
+
+
+def group_scopes(slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True
+    ).first()
+    return None if group_id is None else [group_scope(group_id)]
+
+
+def profile_scopes(username):
+    pk = author_id(username)
+    return None if pk is None else [author_scope(pk)]
+
+
+def post_scopes(username, post_id):
+    # Карточка автора на странице поста выводит его счётчики
+    pk = author_id(username)
+    return None if pk is None else [author_scope(pk), post_scope(post_id)]
+
+
+@replica_reads
+@conditional(index_scopes)
 def index(request):
-    post_list = Post.objects.order_by("-pub_date").all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(
-        request,
-        'index.html',
-        {'page': page, 'paginator': paginator}
-    )
+    paginator = CursorPaginator(queries.index_feed(), 10)
+    page = paginator.get_page(request.GET.get('cursor'))
+    context = {'page': page, 'paginator': paginator}
+    context.update(fragment_context(request, INDEX))
+    return render(request, 'index.html', context)
 
 
+@replica_reads
+@conditional(group_scopes)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all().order_by("-pub_date")[:12]
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request,
-                  "group.html",
-                  {"group": group,
-                   "posts": posts,
-                   'page': page,
-                   'paginator': paginator}
-                  )
+    paginator = CursorPaginator(queries.group_feed(group), 10)
+    page = paginator.get_page(request.GET.get('cursor'))
+    context = {"group": group, 'page': page, 'paginator': paginator}
+    context.update(fragment_context(request, group_scope(group.pk)))
+    return render(request, "group.html", context)
+
+
+def search(request):
+    """ Поиск постов по тексту и названию группы """
+    query = request.GET.get('q', '').strip()
+    paginator = SearchPaginator(query, 10)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'search.html',
+                  {'search_query': query, 'page': page,
+                   'paginator': paginator})
 
 
 @login_required
 def new_post(request):
     """ Добавить новую запись """
-    form = PostForm(request.POST or None, files=request.FILES or None)
+    form = PostForm(request.POST or None, files=request.FILES or None,
+                    rejected_files=getattr(request, 'rejected_uploads', ()))
 
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        thumbnails.schedule(post)
         return redirect('index')
 
     return render(request,
@@ -51,63 +91,77 @@ def new_post(request):
                   )
 
 
+@replica_reads
+@conditional(profile_scopes)
 def profile(request, username):
     """ Отобразить все посты пользователя """
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.order_by("-pub_date").all()
-    count = posts.count()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
+    stats = AuthorStats.objects.for_author(author)
+    paginator = CursorPaginator(queries.author_feed(author), 10)
+    page = paginator.get_page(request.GET.get('cursor'))
 
     follow_status = None
     if request.user.username:
         follow_status = Follow.objects.filter(user=request.user,
                                               author=author).exists()
 
-    followers = Follow.objects.filter(author=author).count
-    following_authors = Follow.objects.filter(user=author).count
-
-    return render(
-        request,
-        'profile.html',
-        {'author': author,
-         'full_name': author.get_full_name,
-         'count': count,
-         'page': page,
-         'paginator': paginator,
-         "following": follow_status,
-         'followers': followers,
-         'following_authors': following_authors}
-    )
-
-
+    context = {'author': author,
+               'full_name': author.get_full_name,
+               'count': stats.posts_count,
+               'page': page,
+               'paginator': paginator,
+               "following": follow_status,
+               'followers': stats.followers_count,
+               'following_authors': stats.following_count}
+    context.update(fragment_context(request, author_scope(author.pk),
+                                    viewer=request.user == author))
+    return render(request, 'profile.html', context)
+
+
+@replica_reads
+@conditional(post_scopes)
 def post_view(request, username, post_id):
     """ Отобразить конкретный пост пользователя """
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    count = posts.count()
-    post = get_object_or_404(Post, pk=post_id)
-    comments = post.comments.order_by('-created')
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
+    stats = AuthorStats.objects.for_author(author)
+    post = get_object_or_404(queries.post_detail(), pk=post_id)
+    comments = queries.post_comments(post.pk)
+    paginator = CursorPaginator(comments, settings.COMMENTS_PAGE_SIZE,
+                                queries.COMMENT_ORDERING)
     form = CommentForm()
 
-    followers = Follow.objects.filter(author=author).count
-    following_authors = Follow.objects.filter(user=author).count
-
     return render(
         request,
         'post.html',
         {'author': author,
          'full_name': author.get_full_name,
-         'count': count,
+         'count': stats.posts_count,
          'comments': comments,
+         'comments_page': paginator.get_page(request.GET.get('cursor')),
          'post': post,
          'form': form,
-         'followers': followers,
-         'following_authors': following_authors}
+         'followers': stats.followers_count,
+         'following_authors': stats.following_count}
     )
 
 
+@replica_reads
+@conditional(post_scopes)
+def post_comments(request, username, post_id):
+    """ Следующая порция комментариев поста для кнопки «Показать ещё» """
+    get_object_or_404(Post.objects.only('pk'), pk=post_id,
+                      author__username=username)
+    paginator = CursorPaginator(queries.post_comments(post_id),
+                                settings.COMMENTS_PAGE_SIZE,
+                                queries.COMMENT_ORDERING)
+    return render(request, 'includes/comment_list.html',
+                  {'username': username, 'post_id': post_id,
+                   'comments_page': paginator.get_page(
+                       request.GET.get('cursor'))})
+
+
 @login_required
 def post_edit(request, username, post_id):
     """ Редактирование поста пользователя """
@@ -122,10 +176,13 @@ def post_edit(request, username, post_id):
 
     form = PostForm(request.POST or None,
                     files=request.FILES or None,
-                    instance=post)
+                    instance=post,
+                    rejected_files=getattr(request, 'rejected_uploads', ()))
     if form.is_valid():
         post = form.save(commit=False)
         post.save()
+        if 'image' in form.changed_data:
+            thumbnails.schedule(post)
         return redirect(url)
 
     return render(request,
@@ -174,12 +231,9 @@ def add_comment(request, username, post_id):
 @login_required
 def follow_index(request):
     """ Отображение страницы с постами подписок """
-    posts_list = Post.objects.filter(
-        author__following__user=request.user).select_related(
-        'author', 'group').order_by("-pub_date")
-    paginator = Paginator(posts_list, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator = CursorPaginator(queries.follow_feed(request.user), 5,
+                                timeline.FEED_ORDERING)
+    page = paginator.get_page(request.GET.get('cursor'))
     return render(request,
                   "follow.html",
                   {'paginator': paginator,
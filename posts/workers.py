@@ -0,0 +1,49 @@
+""" Пулы потоков для работы, которую не нужно делать во время запроса.
+
+Размер пула задаёт настройка `<ИМЯ>_WORKERS` (THUMBNAIL_WORKERS,
+TIMELINE_WORKERS). При нуле задача выполняется сразу в вызывающем
+потоке — так в тестах и командах не нужно ждать пул. Ошибка задачи
+записывается в журнал и не доходит до вызвавшего её запроса.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def _run(function, args):
+    try:
+        function(*args)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой',
+                         function.__qualname__)
+
+
+def _run_in_worker(function, args):
+    try:
+        _run(function, args)
+    finally:
+        # У каждого потока пула своё подключение к базе
+        connection.close()
+
+
+def submit(pool, function, *args):
+    """ Выполнить `function(*args)` в пуле `pool` """
+    workers = getattr(settings, f'{pool.upper()}_WORKERS')
+    if not workers:
+        _run(function, args)
+        return
+    with _lock:
+        executor = _executors.get(pool)
+        if executor is None:
+            executor = _executors[pool] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=pool,
+            )
+    executor.submit(_run_in_worker, function, args)
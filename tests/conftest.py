@@ -1,4 +1,23 @@
+import pytest
+
 pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.fixture(autouse=True)
+def inline_thumbnails(settings):
+    # Миниатюры создаются в том же потоке, что и запрос теста
+    settings.THUMBNAIL_WORKERS = 0
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Очистка базы между тестами не проходит через сигналы,
+    # поэтому страницы и версии лент предыдущих тестов сбрасываются
+    from django.core.cache import caches
+
+    yield
+    for cache in caches.all():
+        cache.clear()
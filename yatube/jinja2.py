@@ -0,0 +1,110 @@
+""" Рендеринг горячих шаблонов через Jinja2.
+
+Шаблоны ленты, поста и профиля повторены в templates/jinja2 на языке
+Jinja2. Они дают тот же HTML, что и шаблоны Django, но Jinja2
+компилирует шаблон в код Python, поэтому include карточек и вывод
+переменных в цикле по ленте обходятся заметно дешевле (замер —
+команда render_benchmark).
+
+Какие шаблоны рендерит Jinja2, задаёт настройка JINJA2_TEMPLATES.
+Бэкенд SelectiveJinja2 стоит в TEMPLATES первым и на остальные имена
+отвечает TemplateDoesNotExist, так что их находит бэкенд Django.
+По умолчанию набор пуст и всё рендерит Django; без установленного
+Jinja2 бэкенд не подключается вовсе.
+
+Окружение повторяет Django там, где от этого зависит вывод: значения
+в {{ }} локализуются и экранируются так же, отсутствующие переменные
+выводятся пустой строкой, а фрагменты `cache` хранятся под теми же
+ключами, что и у тега {% cache %}, — оба движка делят один кеш.
+"""
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.template import TemplateDoesNotExist
+from django.template.backends.jinja2 import Jinja2
+from django.template.backends.jinja2 import Template as Jinja2Template
+from django.template.defaultfilters import (linebreaksbr, truncatechars,
+                                            urlencode)
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils.formats import localize
+from django.utils.html import conditional_escape
+from django.utils.timezone import template_localtime
+from jinja2 import Environment, Undefined
+from markupsafe import Markup
+
+from posts.templatetags.post_images import image_context
+from yatube import timing
+
+
+def finalize(value):
+    """ Значение в {{ }} так же, как его выводит шаблон Django """
+    # Строк (большей части значений) локализация не касается
+    if not isinstance(value, str):
+        value = str(localize(template_localtime(value)))
+    return conditional_escape(value)
+
+
+def url(name, *args, **kwargs):
+    return reverse(name, args=args, kwargs=kwargs)
+
+
+def cache(timeout, fragment_name, *vary_on, caller):
+    """ Аналог {% cache %}: `{% call cache(timeout, name, ...) %}` """
+    try:
+        fragment_cache = caches['template_fragments']
+    except InvalidCacheBackendError:
+        fragment_cache = caches['default']
+    if timeout is not None:
+        timeout = int(timeout)
+    key = make_template_fragment_key(fragment_name, vary_on)
+    value = fragment_cache.get(key)
+    if value is None:
+        value = str(caller())
+        fragment_cache.set(key, value, timeout)
+    return Markup(value)
+
+
+def environment(**options):
+    # Как в Django: отсутствующая переменная — пустая строка
+    options['undefined'] = Undefined
+    env = Environment(finalize=finalize, keep_trailing_newline=True,
+                      **options)
+
+    def post_image(post):
+        template = env.get_template('includes/post_image.html')
+        return Markup(template.render(image_context(post)))
+
+    env.globals.update({
+        'url': url,
+        'static': static,
+        'cache': cache,
+        'post_image': post_image,
+    })
+    env.filters.update({
+        'linebreaksbr': linebreaksbr,
+        'truncatechars': truncatechars,
+        'urlencode': urlencode,
+    })
+    return env
+
+
+class TimedJinja2Template(Jinja2Template):
+    def render(self, context=None, request=None):
+        return timing.timed_render(super().render, context, request)
+
+
+class SelectiveJinja2(Jinja2):
+    """ Бэкенд Jinja2 только для шаблонов из JINJA2_TEMPLATES """
+    def get_template(self, template_name):
+        if template_name not in settings.JINJA2_TEMPLATES:
+            raise TemplateDoesNotExist(template_name, backend=self)
+        return self.load(template_name)
+
+    def load(self, template_name):
+        """ Шаблон Jinja2 независимо от JINJA2_TEMPLATES """
+        template = super().get_template(template_name)
+        return TimedJinja2Template(template.template, self)
+
+    def from_string(self, template_code):
+        return TimedJinja2Template(self.env.from_string(template_code), self)
@@ -0,0 +1,343 @@
+""" Метрики в текстовом формате Prometheus.
+
+Каждый процесс копит счётчики и гистограммы в памяти и не чаще раза
+в METRICS_FLUSH_INTERVAL секунд сохраняет их в свой файл
+`METRICS_DIR/<pid>-<uuid>.json` (запись через временный файл
+и os.replace, поэтому читатель не увидит файл наполовину). Случайная
+часть имени нужна потому, что PID завершившегося процесса может
+достаться новому, и тот не должен перезаписать чужие счётчики.
+
+Страница /metrics/ складывает файлы всех процессов. Файлы завершившихся
+процессов она переносит в `aggregate.json` — так счётчики не
+сбрасываются при перезапуске воркеров, а файлы не копятся. Без
+METRICS_DIR метрики видны только в пределах процесса.
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.urls import Resolver404, resolve
+
+from yatube import timing
+
+# Границы корзин гистограммы длительности в секундах
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HELP = {
+    'yatube_requests_total': 'Запросы по представлениям',
+    'yatube_request_duration_seconds': 'Длительность обработки запроса',
+    'yatube_db_queries_total': 'Запросы к базе данных',
+    'yatube_db_query_seconds_total': 'Время запросов к базе данных',
+    'yatube_cache_requests_total': 'Чтения из кеша: попадания и промахи',
+}
+
+# Файл, в котором копятся метрики завершившихся процессов
+AGGREGATE = 'aggregate.json'
+
+_MISSING = object()
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.clear()
+
+    def clear(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.flushed = 0
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[self._key(name, labels)] += value
+
+    def observe(self, name, value, **labels):
+        """ Добавить значение в гистограмму: [корзины..., сумма, число] """
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                key, [0] * len(BUCKETS) + [0.0, 0]
+            )
+            for index, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return _snapshot(self.counters, self.histograms)
+
+    def filename(self):
+        """ Имя файла процесса в METRICS_DIR """
+        pid = os.getpid()
+        if self.pid != pid:
+            if self.pid is not None:
+                # Процесс создан fork: счётчики до него учтены
+                # в файле родителя
+                self.clear()
+            self.pid = pid
+            self.name = f'{pid}-{uuid.uuid4().hex}.json'
+        return self.name
+
+    def flush(self, force=False):
+        """ Сохранить метрики процесса в METRICS_DIR """
+        directory = settings.METRICS_DIR
+        now = time.monotonic()
+        if not directory or (
+                not force
+                and now - self.flushed < settings.METRICS_FLUSH_INTERVAL):
+            return
+        self.flushed = now
+        os.makedirs(directory, exist_ok=True)
+        _write(directory, self.filename(), self.snapshot())
+
+
+registry = Registry()
+
+
+def _snapshot(counters, histograms):
+    return {
+        'counters': [[name, dict(labels), value] for
+                     (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), list(values)] for
+                       (name, labels), values in histograms.items()],
+    }
+
+
+def _write(directory, name, snapshot):
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as output:
+        json.dump(snapshot, output)
+    os.replace(temporary, os.path.join(directory, name))
+
+
+def _read(directory, names):
+    snapshots = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name)) as source:
+                snapshots.append(json.load(source))
+        except (OSError, ValueError):
+            # Файл удалён или повреждён: пропускаем его
+            continue
+    return snapshots
+
+
+def _finished(name):
+    """ Завершился ли процесс, записавший файл `name` """
+    pid = name.split('-', 1)[0].split('.', 1)[0]
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _process_files(directory):
+    """ Файлы процессов в METRICS_DIR; метрики завершившихся
+    переносятся в AGGREGATE """
+    names = [name for name in os.listdir(directory)
+             if name.endswith('.json') and name != AGGREGATE]
+    finished = [name for name in names if _finished(name)]
+    if finished:
+        snapshots = _read(directory, [AGGREGATE] + finished)
+        _write(directory, AGGREGATE, _snapshot(*_merge(snapshots)))
+        for name in finished:
+            os.remove(os.path.join(directory, name))
+    return [name for name in names if name not in finished]
+
+
+def collect():
+    """ Метрики всех процессов, сложенные по имени и меткам """
+    snapshots = [registry.snapshot()]
+    directory = settings.METRICS_DIR
+    if directory and os.path.isdir(directory):
+        own = registry.filename()
+        # Перенос в AGGREGATE и чтение не должны пересекаться
+        # с другим сбором: иначе файл будет учтён дважды или ни разу
+        with open(os.path.join(directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            names = [name for name in _process_files(directory)
+                     if name != own]
+            snapshots += _read(directory, [AGGREGATE] + names)
+    return _merge(snapshots)
+
+
+def _merge(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[Registry._key(name, labels)] += value
+        for name, labels, values in snapshot['histograms']:
+            key = Registry._key(name, labels)
+            total = histograms.setdefault(key, [0] * len(values))
+            histograms[key] = [a + b for a, b in zip(total, values)]
+    return counters, histograms
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value
+                          in zip(pairs, escaped)) + '}'
+
+
+def render():
+    counters, histograms = collect()
+    lines = []
+    typed = set()
+
+    def header(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# HELP {name} {HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, 'counter')
+        lines.append(f'{name}{_labels(labels)} {value:g}')
+    for (name, labels), values in sorted(histograms.items()):
+        header(name, 'histogram')
+        cumulative = values[:len(BUCKETS)]
+        for bound, count in zip(BUCKETS, cumulative):
+            lines.append(
+                f'{name}_bucket{_labels(labels, le=f"{bound:g}")} {count}'
+            )
+        lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} '
+                     f'{values[-1]}')
+        lines.append(f'{name}_sum{_labels(labels)} {values[-2]:g}')
+        lines.append(f'{name}_count{_labels(labels)} {values[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        # Ответ из кеша страниц отдан до разбора адреса
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return 'unknown'
+    return match.view_name or 'unknown'
+
+
+class QueryCounter:
+    """ Обёртка execute: число и время запросов к базе """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """ Число запросов, их длительность и запросы к базе по представлениям """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+
+        view = view_name(request)
+        registry.inc('yatube_requests_total', view=view,
+                     method=request.method, status=response.status_code)
+        registry.observe('yatube_request_duration_seconds',
+                         time.perf_counter() - started, view=view)
+        registry.inc('yatube_db_queries_total', counter.count, view=view)
+        registry.inc('yatube_db_query_seconds_total', counter.seconds,
+                     view=view)
+        registry.flush()
+        return response
+
+
+class CacheMetricsMixin:
+    """ Кеш, который считает попадания и промахи чтений """
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        # Имя LocMemCache или последний каталог пути файлового кеша
+        self.metrics_label = (os.path.basename(location.rstrip(os.sep))
+                              or 'default')
+
+        # get_many бэкенда может вызывать get для каждого ключа
+        self.in_get_many = False
+
+    def get(self, key, default=None, version=None):
+        if self.in_get_many:
+            return super().get(key, default, version)
+        with timing.track('cache'):
+            value = super().get(key, _MISSING, version)
+        self._record(hits=int(value is not _MISSING),
+                     misses=int(value is _MISSING))
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        self.in_get_many = True
+        try:
+            with timing.track('cache'):
+                values = super().get_many(keys, version)
+        finally:
+            self.in_get_many = False
+        self._record(hits=len(values), misses=len(keys) - len(values))
+        return values
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with timing.track('cache'):
+            super().set(key, value, timeout, version)
+
+    def _record(self, hits, misses):
+        for result, count in (('hit', hits), ('miss', misses)):
+            if count:
+                registry.inc('yatube_cache_requests_total', count,
+                             cache=self.metrics_label, result=result)
+
+
+class InstrumentedLocMemCache(CacheMetricsMixin, LocMemCache):
+    pass
+
+
+class InstrumentedFileBasedCache(CacheMetricsMixin, FileBasedCache):
+    pass
+
+
+def metrics_view(request):
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(render(),
+                        content_type='text/plain; version=0.0.4')
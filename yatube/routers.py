@@ -0,0 +1,81 @@
+""" Чтение из реплик базы данных.
+
+Реплики — копии основной базы (DATABASE_REPLICAS), которые обновляет
+команда sync_replicas. Из реплики читают только представления
+с декоратором `replica_reads`, и только при безопасном методе запроса:
+одна реплика на весь запрос, чтобы данные страницы были согласованы.
+Всё остальное, все записи и чтения внутри транзакций идут в основную
+базу.
+
+Чтобы пользователь сразу видел свои изменения, после запроса
+с записью (POST и т. п.) ему ставится cookie, и в течение
+DATABASE_REPLICA_STICKY_SECONDS его запросы читают основную базу.
+Остальные видят изменения после очередной синхронизации реплик.
+"""
+import functools
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+STICKY_COOKIE = 'primary_reads'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica = ContextVar('replica', default=None)
+
+
+def replica_reads(view):
+    """ Декоратор: чтения представления идут в случайную реплику """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (not settings.DATABASE_REPLICAS
+                or request.method not in SAFE_METHODS
+                or STICKY_COOKIE in request.COOKIES):
+            return view(request, *args, **kwargs)
+        token = _replica.set(random.choice(settings.DATABASE_REPLICAS))
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _replica.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        replica = _replica.get()
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Во всех базах одни и те же данные
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Схема реплик приходит вместе с копией основной базы
+        return db not in settings.DATABASE_REPLICAS
+
+
+class PrimaryStickinessMiddleware:
+    """ После записи пользователь какое-то время читает основную базу """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (settings.DATABASE_REPLICAS
+                and request.method not in SAFE_METHODS
+                and response.status_code < 500):
+            response.set_cookie(
+                STICKY_COOKIE, '1',
+                max_age=settings.DATABASE_REPLICA_STICKY_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
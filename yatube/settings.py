@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import importlib.util
 import os
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -51,6 +52,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.metrics.MetricsMiddleware',
+    # Подключается только при SERVER_TIMING = True
+    'yatube.timing.ServerTimingMiddleware',
+    # Подключается только при заданном SLOW_QUERY_THRESHOLD
+    'yatube.slow_queries.SlowQueryMiddleware',
+    # Попадания в кеш страниц обслуживаются до остальных middleware
+    'posts.page_cache.AnonymousPageCacheMiddleware',
+    'yatube.routers.PrimaryStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -66,7 +75,8 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендеринга для Server-Timing
+        'BACKEND': 'yatube.timing.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,6 +91,24 @@ TEMPLATES = [
     },
 ]
 
+# Шаблоны, которые рендерит Jinja2 (yatube/jinja2.py): те же имена,
+# что у шаблонов Django, версии на Jinja2 лежат в templates/jinja2.
+# Например JINJA2_TEMPLATES=index.html,group.html,profile.html,post.html
+JINJA2_TEMPLATES = frozenset(
+    name for name in os.environ.get('JINJA2_TEMPLATES', '').split(',') if name
+)
+if importlib.util.find_spec('jinja2') is not None:
+    TEMPLATES.insert(0, {
+        'BACKEND': 'yatube.jinja2.SelectiveJinja2',
+        'DIRS': [os.path.join(TEMPLATES_DIR, 'jinja2')],
+        'APP_DIRS': False,
+        'OPTIONS': {
+            'environment': 'yatube.jinja2.environment',
+            'context_processors':
+                TEMPLATES[0]['OPTIONS']['context_processors'],
+        },
+    })
+
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
 
@@ -89,11 +117,33 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # SQLite с WAL, прагмами и BEGIN IMMEDIATE (yatube/backends/sqlite3)
+        'ENGINE': 'yatube.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Подключение переиспользуется запросами в течение минуты
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Реплики для чтения лент и профилей: копии основной базы, которые
+# обновляет команда sync_replicas. Число задаётся переменной окружения
+# DATABASE_REPLICAS; в тестах реплики указывают на тестовую базу.
+DATABASE_REPLICAS = []
+for number in range(1, int(os.environ.get('DATABASE_REPLICAS', 0)) + 1):
+    DATABASE_REPLICAS.append(f'replica{number}')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'NAME': os.path.join(BASE_DIR, f'db.replica{number}.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['yatube.routers.ReplicaRouter']
+# Сколько секунд после записи пользователь читает основную базу;
+# должно покрывать промежуток между запусками sync_replicas
+DATABASE_REPLICA_STICKY_SECONDS = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -145,6 +195,24 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузка изображений постов
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploads.UploadSizeLimitHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Файлы больше этого размера отклоняются ещё при приёме запроса
+UPLOAD_MAX_FILE_SIZE = 10 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+# Изображения уменьшаются до этой длины большей стороны
+POST_IMAGE_MAX_SIDE = 2048
+POST_IMAGE_QUALITY = 85
+
+# Ширины миниатюр изображений постов для srcset
+POST_IMAGE_WIDTHS = (480, 960, 1440)
+# Потоки, создающие миниатюры; 0 — создавать сразу после сохранения поста
+THUMBNAIL_WORKERS = 2
+
 # Login
 
 LOGIN_URL = "/auth/login/"
@@ -159,12 +227,86 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 # Идентификатор текущего сайта
 SITE_ID = 1
 
-# Кеш
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Кеш. Версии лент, фрагменты и страницы должны быть общими для всех
+# процессов сайта: иначе процесс не узнает об изменениях, сделанных
+# в другом, и до часа отдаёт устаревшие ленты. Кеш в памяти процесса
+# годится только для одного процесса (runserver); для нескольких
+# воркеров задайте CACHE_DIR — каталог файлового кеша, общий для
+# процессов на этой машине (проверка posts.W001 напомнит об этом)
+CACHE_DIR = os.environ.get('CACHE_DIR')
+if CACHE_DIR:
+    CACHES = {
+        'default': {
+            # Файловый кеш, который считает попадания и промахи
+            'BACKEND': 'yatube.metrics.InstrumentedFileBasedCache',
+            'LOCATION': os.path.join(CACHE_DIR, 'default'),
+        },
+        # Версии лент хранятся отдельно от фрагментов, чтобы не
+        # вытесняться ими
+        'feed_versions': {
+            'BACKEND': 'yatube.metrics.InstrumentedFileBasedCache',
+            'LOCATION': os.path.join(CACHE_DIR, 'feed-versions'),
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
     }
-}
+else:
+    CACHES = {
+        'default': {
+            # LocMemCache, который считает попадания и промахи для /metrics/
+            'BACKEND': 'yatube.metrics.InstrumentedLocMemCache',
+        },
+        'feed_versions': {
+            'BACKEND': 'yatube.metrics.InstrumentedLocMemCache',
+            'LOCATION': 'feed-versions',
+        },
+    }
+FEED_VERSIONS_CACHE = 'feed_versions'
+# Время жизни фрагментов лент; свежесть обеспечивают версии лент
+FEED_CACHE_TIMEOUT = 60 * 60
+# Кеш страниц для анонимных посетителей
+PAGE_CACHE = 'default'
+PAGE_CACHE_TIMEOUT = 10 * 60
+
+# Лента подписок
+# Сколько последних постов хранится в ленте каждого пользователя
+FOLLOW_TIMELINE_LENGTH = 500
+# Посты авторов, у которых подписчиков больше, не раскладываются
+# по лентам при публикации, а подмешиваются в ленту при чтении
+FOLLOW_FANOUT_LIMIT = 1000
+# Раскладка снова включается, только когда подписчиков становится
+# на столько меньше предела: отписка и подписка у самой границы
+# не перекладывают ленты всех подписчиков каждый раз
+FOLLOW_FANOUT_HYSTERESIS = 100
+# Потоки, раскладывающие посты автора по лентам подписчиков, когда
+# раскладка снова включается; 0 — сразу после фиксации отписки
+TIMELINE_WORKERS = 1
+
+# Комментариев на странице поста и в одной порции «Показать ещё»
+COMMENTS_PAGE_SIZE = 20
+
+# Число постов в лентах RSS и Atom
+SYNDICATION_ITEMS = 20
+
+# JSON API: размер страницы по умолчанию и наибольший
+API_PAGE_SIZE = 10
+API_MAX_PAGE_SIZE = 100
+
+# Заголовок Server-Timing и журнал времени каждого запроса
+SERVER_TIMING = os.environ.get('SERVER_TIMING') == '1'
+
+# Журнал медленных запросов: порог в миллисекундах (None — выключен)
+# и файл, куда пишутся запросы с планами
+SLOW_QUERY_THRESHOLD = (float(os.environ['SLOW_QUERY_MS'])
+                        if os.environ.get('SLOW_QUERY_MS') else None)
+SLOW_QUERY_LOG = os.environ.get(
+    'SLOW_QUERY_LOG', os.path.join(BASE_DIR, 'slow_queries.log')
+)
+
+# Метрики: каталог файлов процессов (без него метрики не сохраняются
+# и видны только в пределах процесса) и адреса, которым открыт /metrics/
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_ALLOWED_IPS = ['127.0.0.1']
 
 INTERNAL_IPS = [
     "127.0.0.1",
@@ -0,0 +1,173 @@
+""" Журнал медленных запросов к базе.
+
+Включается настройкой SLOW_QUERY_THRESHOLD (миллисекунды). Запрос
+дольше порога записывается строкой JSON в файл SLOW_QUERY_LOG вместе
+с представлением, строкой кода проекта, из которой он пришёл, и планом
+`EXPLAIN QUERY PLAN`. Одинаковые по форме запросы (без учёта значений
+параметров и длины списков IN) получают общий отпечаток; план для
+каждой формы строится один раз за процесс. Команда slow_queries
+складывает журнал по формам и показывает самые тяжёлые.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections
+
+from yatube.metrics import view_name
+
+logger = logging.getLogger(__name__)
+
+# Сколько планов хранить в памяти процесса
+PLANS_LIMIT = 1000
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_SPACES = re.compile(r'\s+')
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+_plans = {}
+_write_lock = threading.Lock()
+
+
+def shape(sql):
+    """ Текст запроса без различий в длине списков IN и пробелах """
+    return _IN_LIST.sub('IN (...)', _SPACES.sub(' ', sql.strip()))
+
+
+def fingerprint(sql_shape):
+    return hashlib.md5(sql_shape.encode()).hexdigest()[:12]
+
+
+def origin():
+    """ Ближайшая к запросу строка кода проекта: файл, строка, функция """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        # Обёртки execute и middleware из пакета yatube пропускаются
+        if (filename.startswith(settings.BASE_DIR)
+                and not filename.startswith(_PACKAGE_DIR)
+                and 'site-packages' not in filename):
+            return (f'{os.path.relpath(filename, settings.BASE_DIR)}:'
+                    f'{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return None
+
+
+def explain(connection, sql, params):
+    """ План запроса; для всего, кроме SELECT, план не строится """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    prefix = connection.ops.explain_query_prefix()
+    # Курсор без обёрток execute: план не попадает в журнал и метрики
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(f'{prefix} {sql}', params)
+        return [' '.join(str(value) for value in row)
+                for row in cursor.fetchall()]
+    except DatabaseError as error:
+        return [f'не удалось построить план: {error}']
+    finally:
+        cursor.close()
+
+
+def write(record):
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _write_lock:
+        with open(settings.SLOW_QUERY_LOG, 'a', encoding='utf-8') as log:
+            log.write(line)
+
+
+class SlowQueryLogger:
+    """ Обёртка execute: записать запросы дольше порога """
+    def __init__(self, request, threshold):
+        self.request = request
+        self.threshold = threshold
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            if elapsed >= self.threshold:
+                self.record(sql, params, many, context['connection'],
+                            elapsed)
+
+    def record(self, sql, params, many, connection, elapsed):
+        sql_shape = shape(sql)
+        key = fingerprint(sql_shape)
+        if key not in _plans and not many:
+            if len(_plans) >= PLANS_LIMIT:
+                _plans.clear()
+            _plans[key] = explain(connection, sql, params)
+        record = {
+            'time': time.time(),
+            'ms': round(elapsed * 1000, 2),
+            'fingerprint': key,
+            'shape': sql_shape,
+            'view': view_name(self.request),
+            'origin': origin(),
+            'plan': _plans.get(key),
+        }
+        logger.warning('%s мс %s: %s', record['ms'], record['view'],
+                       sql_shape)
+        write(record)
+
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        if settings.SLOW_QUERY_THRESHOLD is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        wrapper = SlowQueryLogger(request,
+                                  settings.SLOW_QUERY_THRESHOLD / 1000)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(wrapper))
+            return self.get_response(request)
+
+
+def read(path):
+    """ Записи журнала; повреждённые строки пропускаются """
+    with open(path, encoding='utf-8') as source:
+        for line in source:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def aggregate(records):
+    """ Сводка по формам запросов, самые тяжёлые по суммарному времени """
+    shapes = {}
+    for record in records:
+        entry = shapes.setdefault(record['fingerprint'], {
+            'fingerprint': record['fingerprint'],
+            'shape': record['shape'],
+            'count': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'views': {},
+            'origins': {},
+            'plan': None,
+        })
+        entry['count'] += 1
+        entry['total_ms'] += record['ms']
+        entry['max_ms'] = max(entry['max_ms'], record['ms'])
+        for field, counts in (('view', entry['views']),
+                              ('origin', entry['origins'])):
+            if record.get(field):
+                counts[record[field]] = counts.get(record[field], 0) + 1
+        entry['plan'] = record.get('plan') or entry['plan']
+    return sorted(shapes.values(), key=lambda entry: -entry['total_ms'])
@@ -0,0 +1,130 @@
+""" Заголовок Server-Timing и журнал времени обработки запросов.
+
+Включается настройкой SERVER_TIMING. Время копится по категориям
+в контекстной переменной текущего запроса:
+
+* db — запросы к базе (обёртка execute подключений);
+* template — рендеринг шаблонов вместе с вложенными include
+  (бэкенды TimedDjangoTemplates и yatube.jinja2.SelectiveJinja2);
+* thumbnail — поиск и создание миниатюр в потоке запроса;
+* cache — чтение и запись кеша (InstrumentedLocMemCache);
+* view — весь запрос целиком.
+
+Категории пересекаются: например, поиск миниатюр идёт во время
+рендеринга шаблона. Когда замер выключен, middleware не подключается,
+а `track()` сводится к чтению контекстной переменной.
+"""
+import json
+import logging
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+from django.template.backends.django import Template as DjangoTemplate
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ('db', 'template', 'thumbnail', 'cache')
+
+_timings = ContextVar('timings', default=None)
+
+
+class track:
+    """ Контекстный менеджер: добавить время блока к категории """
+    __slots__ = ('name', 'timings', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _timings.get()
+        if self.timings is not None:
+            self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings[self.name] += time.perf_counter() - self.started
+
+
+class Timings(dict):
+    """ Время по категориям и число запросов к базе """
+    def __init__(self):
+        super().__init__(dict.fromkeys(CATEGORIES, 0.0))
+        self.queries = 0
+        self.depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        with track('db'):
+            return execute(sql, params, many, context)
+
+
+def timed_render(render, context, request):
+    """ Вызвать render шаблона бэкенда, добавив время к категории template """
+    timings = _timings.get()
+    if timings is None or timings.depth:
+        return render(context, request)
+    # Шаблон, отрендеренный через бэкенд внутри другого
+    # (render_to_string в теге), уже учтён во внешнем
+    timings.depth += 1
+    try:
+        with track('template'):
+            return render(context, request)
+    finally:
+        timings.depth -= 1
+
+
+class TimedTemplate(DjangoTemplate):
+    def render(self, context=None, request=None):
+        return timed_render(super().render, context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """ Бэкенд шаблонов Django, который замеряет время рендеринга """
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = Timings()
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings))
+                response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        total = time.perf_counter() - started
+
+        durations = dict(timings, view=total)
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={seconds * 1000:.1f}'
+            for name, seconds in durations.items()
+        )
+        match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': timings.queries,
+            **{f'{name}_ms': round(seconds * 1000, 2)
+               for name, seconds in durations.items()},
+        }))
+        return response
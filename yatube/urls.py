@@ -21,6 +21,8 @@ from django.contrib import admin
 from django.contrib.flatpages import views
 from django.urls import include, path
 
+from yatube import metrics
+
 handler404 = "posts.views.page_not_found"  # noqa
 handler500 = "posts.views.server_error"  # noqa
 
@@ -36,6 +38,9 @@ urlpatterns = [
     #  ищем совпадения в файле django.contrib.auth.urls
     path("auth/", include("django.contrib.auth.urls")),
 
+    #  метрики для Prometheus
+    path("metrics/", metrics.metrics_view, name="metrics"),
+
     #  раздел администратора
     path("admin/", admin.site.urls),
 